@@ -0,0 +1,189 @@
+'''
+Benchmarks for Sokoblue. Runs with fixed seeds and pygame's dummy video
+driver, so results are repeatable and need no window:
+
+    python bench.py --output before.json
+
+Reports, as JSON:
+    generation  RandomGameMap build time and rejection rate per level of
+                the schedule main() uses (level_params), for each mode
+    try_step    MapController.try_step latency per move
+    render      drawMap / loadMapDisplay frame times by map size
+    restart     restart cost by number of moves made
+Times are in milliseconds.
+'''
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+import argparse, json, platform, random, statistics, time
+os.chdir(os.path.dirname(os.path.abspath(__file__))) #core loads Imgs/ relative to here
+import core
+
+
+def summary(samples):
+    '''
+    Params: samples (list of seconds)
+    Outputs: dict
+    Count, mean, median, 95th percentile and worst case, in milliseconds.
+    '''
+    ordered = sorted(samples)
+    return {"count": len(ordered),
+            "mean": statistics.fmean(ordered) * 1000,
+            "p50": ordered[len(ordered) // 2] * 1000,
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "max": ordered[-1] * 1000}
+
+
+class BenchController(core.MapController):
+    '''
+    A MapController that stays on its map when random moves happen to solve it.
+    The stock one would load the next level, and exit the program with none queued.
+    '''
+
+    def load_next_map(self):
+        pass
+
+
+def bench_generation(levels, samples, modes, seed):
+    '''
+    Params: levels, samples, modes, seed (int, int, tuple, int)
+    Outputs: dict
+    Builds samples maps for each of the first levels levels, in each mode.
+    '''
+    results = {}
+    for mode in modes:
+        rows = []
+        total_time = 0
+        total_attempts = 0
+        for level in range(levels):
+            h, w, b, wc, d, ids = core.level_params(level)
+            times = []
+            attempts = 0
+            rejections = {}
+            for sample in range(samples):
+                start = time.perf_counter()
+                mp = core.RandomGameMap(h, w, b, wc, d, ids, mode, seed + level * samples + sample)
+                times.append(time.perf_counter() - start)
+                attempts += len(mp.stats.attempts)
+                for reason, count in mp.stats.rejections().items():
+                    rejections[reason] = rejections.get(reason, 0) + count
+            total_time += sum(times)
+            total_attempts += attempts
+            rows.append({"level": level, "size": [h, w], "boxes": b, "walls": wc, "difficulty": d,
+                         "time": summary(times), "attempts": attempts,
+                         "rejection_rate": 1 - samples / attempts, "rejections": rejections})
+        maps = levels * samples
+        results[mode] = {"levels": rows, "maps_per_second": maps / total_time,
+                         "rejection_rate": 1 - maps / total_attempts}
+    return results
+
+
+def pull_map(level, seed):
+    '''
+    Params: level, seed (int, int)
+    Outputs: RandomGameMap
+    A map from the level schedule, made with the pull generator because it's quick.
+    '''
+    return core.RandomGameMap(*core.level_params(level), "pull", seed)
+
+
+def random_moves(mc, count, rng):
+    '''
+    Params: mc, count, rng (MapController, int, Random)
+    Outputs: times (list)
+    Makes count random moves, timing each try_step call.
+    '''
+    times = []
+    for move in range(count):
+        dx, dy = rng.choice(core.Directions)
+        start = time.perf_counter()
+        mc.try_step(dx, dy, mc.get_player_tile())
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_try_step(levels, moves, seed):
+    times = []
+    rng = random.Random(seed)
+    for level in range(levels):
+        core.mc.load_map(pull_map(level, seed + level))
+        times.extend(random_moves(core.mc, moves, rng))
+    return summary(times)
+
+
+def bench_render(levels, frames, seed):
+    '''
+    Params: levels, frames, seed (int, int, int)
+    Outputs: list
+    For each map size: the first, full frame, then frames after a single move each.
+    '''
+    results = []
+    rng = random.Random(seed)
+    for level in range(levels):
+        mp = pull_map(level, seed + level)
+        size = core.TileWidth * max(mp.height, mp.width)
+        core.DISPLAYSURF = core.pygame.display.set_mode((size, size))
+        core.LabelRect = None
+        core.mc.load_map(mp)
+        start = time.perf_counter()
+        core.loadMapDisplay()
+        full = time.perf_counter() - start
+        draws = []
+        displays = []
+        for frame in range(frames):
+            random_moves(core.mc, 1, rng)
+            start = time.perf_counter()
+            core.mc.drawMap()
+            draws.append(time.perf_counter() - start)
+            random_moves(core.mc, 1, rng)
+            start = time.perf_counter()
+            core.loadMapDisplay()
+            displays.append(time.perf_counter() - start)
+        results.append({"level": level, "size": [mp.height, mp.width], "full_frame": full * 1000,
+                        "drawMap": summary(draws), "loadMapDisplay": summary(displays)})
+    return results
+
+
+def bench_restart(counts, seed):
+    results = []
+    rng = random.Random(seed)
+    for count in counts:
+        core.mc.load_map(pull_map(0, seed))
+        random_moves(core.mc, count, rng)
+        made = core.mc.moves
+        start = time.perf_counter()
+        core.mc.restart()
+        results.append({"moves": made, "time": (time.perf_counter() - start) * 1000})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Sokoblue benchmarks")
+    parser.add_argument("--levels", type = int, default = 3, help = "how far into the level schedule to go")
+    parser.add_argument("--samples", type = int, default = 2, help = "maps generated per level and mode")
+    parser.add_argument("--modes", nargs = "+", choices = ("walk", "pull"), default = ["pull", "walk"])
+    parser.add_argument("--moves", type = int, default = 2000, help = "moves timed per map for try_step")
+    parser.add_argument("--frames", type = int, default = 200, help = "frames timed per map size")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--output", help = "write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    core.load_assets()
+    core.FPS = 0 #Don't let the frame cap sleep inside the timings
+    core.mc = BenchController()
+    results = {"python": platform.python_version(), "platform": platform.platform(),
+               "pygame": core.pygame.version.ver, "args": vars(args)}
+    results["generation"] = bench_generation(args.levels, args.samples, args.modes, args.seed)
+    results["try_step"] = bench_try_step(args.levels, args.moves, args.seed)
+    results["render"] = bench_render(args.levels, args.frames, args.seed)
+    results["restart"] = bench_restart((10, 100, 1000, 10000), args.seed)
+    text = json.dumps(results, indent = 2)
+    if(args.output):
+        with open(args.output, "w") as out:
+            out.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
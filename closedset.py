@@ -0,0 +1,181 @@
+'''
+Compact transposition table for the solvers.
+
+A dict keyed by (boxes, player) tuples costs a few hundred bytes per
+position once the big int, the tuple and the parent pointer are counted.
+ClosedSet packs each position into a fixed-width byte key, numbering only
+the cells a box can ever stand on, and keeps the keys in one flat
+open-addressing table. A position costs its key plus two bytes, over a
+load factor of at most MaxLoad.
+
+Instead of a pointer to its parent, each entry records the push that
+reached it. Undoing that push gives the parent, so a solution can still
+be rebuilt (see Solver.rebuild).
+
+The table never grows past max_bytes (while it doubles, the old half-size
+copy is briefly held too). Past that it either raises MemoryError or,
+given a spill directory, moves to a memory-mapped file there and carries
+on growing on disk.
+'''
+import mmap
+import tempfile
+from array import array
+from state import bit_cells
+
+MaxLoad = 0.8
+Start = 0x3FFF #Push recorded for the starting position
+ValueSize = 2 #Pushed box cell * 4 + index of the push direction
+
+
+class ClosedSet():
+    '''
+    Set of positions on one board, each with the push that first reached it.
+    live lists the cells a box can be on (not walls or dead squares). Keys are
+    the player cell + 1 (so an all-zero slot is empty) followed by the boxes,
+    either as a bitmap over live or as a list of live numbers, whichever is shorter.
+    '''
+
+    def __init__(self, live, cells, boxcount, max_bytes = None, spill = None, slots = 1024):
+        if(cells >= Start):
+            raise ValueError("board too big for 14 bit cell numbers")
+        self.number = array("H", bytes(2 * cells)) #number[cell] is the cell's position in live
+        for number, cell in enumerate(live):
+            self.number[cell] = number
+        self.bitmap_size = (len(live) + 7) // 8
+        self.item_size = 1 if len(live) < 256 else 2
+        self.use_bitmap = self.bitmap_size <= self.item_size * boxcount
+        self.key_size = 2 + (self.bitmap_size if self.use_bitmap else self.item_size * boxcount)
+        self.slot_size = self.key_size + ValueSize
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.spill_file = None
+        self.count = 0
+        if(max_bytes is not None):
+            slots = max(16, min(slots, max_bytes // self.slot_size))
+        self.slots = slots
+        self.table = self.allocate(slots)
+
+    def pack(self, boxes, player):
+        '''
+        Params: boxes, player (int, int)
+        Outputs: key (bytes)
+        '''
+        number = self.number
+        if(self.use_bitmap):
+            bits = 0
+            for cell in bit_cells(boxes):
+                bits |= 1 << number[cell]
+            body = bits.to_bytes(self.bitmap_size, "little")
+        else:
+            body = array("B" if self.item_size == 1 else "H", [number[cell] for cell in bit_cells(boxes)]).tobytes()
+        return (player + 1).to_bytes(2, "little") + body
+
+    def allocate(self, slots):
+        '''
+        Params: slots (int)
+        Outputs: bytearray or mmap
+        Zeroed storage for slots entries, spilling to a file once it would pass max_bytes.
+        '''
+        size = slots * self.slot_size
+        if(self.max_bytes is None or size <= self.max_bytes):
+            return bytearray(size)
+        if(self.spill is None):
+            raise MemoryError("closed set would need %d bytes, limit is %d" % (size, self.max_bytes))
+        spill_file = tempfile.TemporaryFile(dir = self.spill)
+        spill_file.truncate(size)
+        table = mmap.mmap(spill_file.fileno(), size)
+        if(self.spill_file is not None):
+            self.spill_file.close()
+        self.spill_file = spill_file
+        return table
+
+    def find(self, key):
+        '''
+        Params: key (bytes)
+        Outputs: offset, found (int, bool)
+        The offset of key's slot, or of the empty slot it would go in.
+        '''
+        table = self.table
+        size = self.slot_size
+        width = self.key_size
+        slot = hash(key) % self.slots
+        while(True):
+            offset = slot * size
+            if(not table[offset] and not table[offset + 1]):
+                return offset, False
+            if(table[offset:offset + width] == key):
+                return offset, True
+            slot += 1
+            if(slot == self.slots):
+                slot = 0
+
+    def add(self, boxes, player, box = Start, d = 0):
+        '''
+        Params: boxes, player, box, d (int, int, int, int)
+        Outputs: True or False
+        Adds a position reached by pushing the box on cell box the d'th way.
+        Returns False, changing nothing, if the position was already there.
+        '''
+        key = self.pack(boxes, player)
+        offset, found = self.find(key)
+        if(found):
+            return False
+        if((self.count + 1) > self.slots * MaxLoad):
+            self.grow()
+            offset, found = self.find(key)
+        self.table[offset:offset + self.slot_size] = key + (box * 4 + d).to_bytes(ValueSize, "little")
+        self.count += 1
+        return True
+
+    def push(self, boxes, player):
+        '''
+        Params: boxes, player (int, int)
+        Outputs: box, d (int, int) or None
+        The push recorded for a position, or None if it isn't in the set.
+        '''
+        offset, found = self.find(self.pack(boxes, player))
+        if(not found):
+            return None
+        value = int.from_bytes(self.table[offset + self.key_size:offset + self.slot_size], "little")
+        return value >> 2, value & 3
+
+    def __contains__(self, position):
+        return self.find(self.pack(*position))[1]
+
+    def grow(self):
+        '''
+        Params: None
+        Outputs: None
+        Doubles the slot count and reinserts every entry.
+        '''
+        old = self.table
+        old_slots = self.slots
+        self.slots *= 2
+        self.table = self.allocate(self.slots)
+        size = self.slot_size
+        width = self.key_size
+        for slot in range(old_slots):
+            offset = slot * size
+            if(old[offset] or old[offset + 1]):
+                key = bytes(old[offset:offset + width])
+                new_offset = self.find(key)[0]
+                self.table[new_offset:new_offset + size] = old[offset:offset + size]
+        if(isinstance(old, mmap.mmap)):
+            old.close()
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return len(self.table)
+
+    def memory(self):
+        #Bytes held in memory rather than in the spill file
+        return 0 if isinstance(self.table, mmap.mmap) else len(self.table)
+
+    def close(self):
+        if(isinstance(self.table, mmap.mmap)):
+            self.table.close()
+        if(self.spill_file is not None):
+            self.spill_file.close()
+            self.spill_file = None
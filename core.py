@@ -1,41 +1,61 @@
 ### IMPORTS
-import pygame, sys, random, time
-from pygame.locals import *
-from copy import *
-from pathfinding.core.diagonal_movement import DiagonalMovement
-from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
+import sys, random, time, argparse, multiprocessing, signal
+from multiprocessing.pool import AsyncResult
+from solver import solve, SOLVED, Deadlocks
+from parallel import ParallelSolver
+from state import State, Board, Zobrist, bit_cells, reachable, replay
+from levelpack import LevelPack, write_pack
+from levelcache import LevelCache
+from instrument import log, span, configure
+from layout import layouts, wall_bits
 ### END IMPORTS
 
 ### PYGAME CONSTANTS
-pygame.init()
+#pygame, images and fonts are only loaded by load_assets, so the game logic can be imported headless
+pygame = None
 TileWidth = 32
 TileHeight = 32
 TileFloorHeight = 32
 DISPLAYSURF = None
 FPS = 30   
-ImageDict = {'floor':pygame.image.load("Imgs/ground.gif"),
-             'wall':pygame.image.load("Imgs/wall.gif"),
-             'diamond':pygame.image.load("Imgs/diamond.gif"),
-             'keeper':pygame.image.load("Imgs/keeper.gif"),
-             'crate':pygame.image.load("Imgs/crate.gif"),
-             'fulldiamond':pygame.image.load("Imgs/fulldiamond.gif")}
-
-TileMapping = { '#':ImageDict['wall'],
-                '.':ImageDict['floor'],
-                'U':ImageDict['diamond'],
-                'O':ImageDict['crate'],
-                '@':ImageDict['keeper'],
-                'V':ImageDict['fulldiamond']}
-FPSClock = pygame.time.Clock()
+ImageDict = None
+TileMapping = None
+FPSClock = None #Caps redraws at FPS frames per second
 Grey = (107,102,102)
 #Grey = (152,148, 147)
 Black = (0,0,0)
 White       = (255,255,255)
 BgColour    = Grey
 TextColour  = White
-myfont = pygame.font.SysFont("monospace", 15)
+myfont = None
 ### END PYGAME CONSTANTS
+
+def load_assets():
+    '''
+    Params: None
+    Outputs: None
+    Starts pygame and loads the images and font. Only the front end needs these, and only the first call does anything.
+    '''
+    global pygame, ImageDict, TileMapping, FPSClock, myfont
+    if(TileMapping is not None):
+        return
+    import pygame
+    pygame.init()
+    ImageDict = {'floor':pygame.image.load("Imgs/ground.gif"),
+                 'wall':pygame.image.load("Imgs/wall.gif"),
+                 'diamond':pygame.image.load("Imgs/diamond.gif"),
+                 'keeper':pygame.image.load("Imgs/keeper.gif"),
+                 'crate':pygame.image.load("Imgs/crate.gif"),
+                 'fulldiamond':pygame.image.load("Imgs/fulldiamond.gif")}
+
+    TileMapping = { '#':ImageDict['wall'],
+                    '.':ImageDict['floor'],
+                    'U':ImageDict['diamond'],
+                    'O':ImageDict['crate'],
+                    '@':ImageDict['keeper'],
+                    'V':ImageDict['fulldiamond']}
+    FPSClock = pygame.time.Clock()
+    myfont = pygame.font.SysFont("monospace", 15)
     
 
 
@@ -49,31 +69,78 @@ class GameController():
     def handle_input(self, com):
         pass
 
+Directions = ((-1, 0), (1, 0), (0, -1), (0, 1)) #Move journal codes 0-3 as (dx, dy)
+Pushed = 4 #Set on a journal code when the move pushed a box
+LurdTable = b"udlrUDLR".ljust(256, b"?") #Journal code to LURD letter
+
 class MapController():
     '''
     Controls everything related to the map and the display of such.
     '''
     current_map = None #The currently loaded map
-    all_maps = [] #All maps available to load
-    moves = 0 #Current movecount
+    all_maps = [] #All maps available to load, or AsyncResults for ones still being generated
+    pool = None #Background level generators, see stream_levels
+    level_tasks = [] #session_tasks for levels not yet handed to the pool, or pack level numbers
+    pack = None #LevelPack being played, see play_pack
+    level_args = {} #build_level arguments for each AsyncResult still queued, so a skipped level can be named
+    ahead = 0 #How many levels to keep queued behind the current one
+    moves = 0 #Current movecount, only moves that went somewhere count so it always matches the journal
+    background = None #Walls, floor and empty diamonds, rendered once per level
+    mapSurf = None #The last frame drawn, updated in place
+    dirty = set() #Tiles touched since the last drawMap
+    history = bytearray() #Journal of player moves on this map, see Directions and Pushed
+    undone = bytearray() #Moves taken back by undo, newest last
+    solved = [] #(level id, LURD) for every level finished this session, in order
+    changed = None #Rects redrawn by the last drawMap, None if everything was
+    zobrist = None #Zobrist tables for the current map's size
+    position_hash = 0 #Zobrist hash of the boxes and player cell, updated as things move, see track
+
+    def get_tile_rect(self, tile):
+        '''
+        Params: tile (Tile)
+        Outputs: Rect
+        The area a tile covers on the map surface
+        '''
+        return pygame.Rect((tile.x * TileWidth, tile.y * TileFloorHeight, TileWidth, TileHeight))
+
+    def drawBackground(self):
+        '''
+        Params: None
+        Outputs: None
+        Renders the static layer of the current map: every tile as if it was empty
+        '''
+        mapSurfWidth = self.current_map.height * TileWidth
+        mapSurfHeight = self.current_map.width * TileHeight
+        self.background = pygame.Surface((mapSurfWidth, mapSurfHeight))
+        self.background.fill(BgColour)
+        for row in self.current_map.tiles:
+            for tile in row:
+                if(tile.base_sprite in TileMapping):
+                    self.background.blit(TileMapping[tile.base_sprite], self.get_tile_rect(tile))
 
     def drawMap(self):
         '''
         params: None
         Outputs: MapSurf
-        Generates a MapSurf from the current map
-        '''
-        mapSurfWidth = self.current_map.width * TileWidth
-        mapSurfHeight = self.current_map.height * TileHeight
-        mapSurf = pygame.Surface((mapSurfWidth, mapSurfHeight))
-        mapSurf.fill(BgColour)
-        for w in range(self.current_map.height):
-            for h in range(self.current_map.width):
-                thisTile = pygame.Rect((w * TileWidth, h * TileFloorHeight, TileWidth, TileHeight))
-                if str(self.get_tile_by_coords(h,w)) in TileMapping:
-                    baseTile = TileMapping[str(self.get_tile_by_coords(h,w))]
-                mapSurf.blit(baseTile, thisTile)
-        return mapSurf
+        Brings the MapSurf up to date with the current map.
+        Only tiles touched since the last call are redrawn, their rects are left in self.changed
+        '''
+        load_assets()
+        if(self.background is None):
+            self.drawBackground()
+            self.mapSurf = self.background.copy()
+            self.dirty.update(obj.tile for obj in [self.current_map.player] + self.current_map.boxes)
+            self.changed = None
+        else:
+            self.changed = []
+        for tile in self.dirty:
+            thisTile = self.get_tile_rect(tile)
+            if str(tile) in TileMapping:
+                self.mapSurf.blit(TileMapping[str(tile)], thisTile)
+            if(self.changed is not None):
+                self.changed.append(thisTile)
+        self.dirty.clear()
+        return self.mapSurf
 
     def load_map(self, mp):
         '''
@@ -81,9 +148,16 @@ class MapController():
         outputs: None
         Loads a specified map
         '''
+        mp.materialise()
         self.current_map = mp
         self.sync_player_loc()
         self.moves = 0
+        self.background = None
+        self.dirty = set()
+        self.history = bytearray()
+        self.undone = bytearray()
+        self.zobrist = Zobrist.for_size(mp.height, mp.width)
+        self.position_hash = self.zobrist.position(mp.to_state())
     
     def load_next_map(self):
         '''
@@ -93,18 +167,98 @@ class MapController():
         '''
         if(self.current_map and len(self.all_maps)):
             self.all_maps.pop(0)
+        self.fill_queue()
+        while(len(self.all_maps) and isinstance(self.all_maps[0], AsyncResult)):
+            args = self.level_args.pop(self.all_maps[0])
+            try:
+                #Only blocks if the background worker hasn't finished this level yet
+                ids, state = self.all_maps[0].get()
+            except RuntimeError as error:
+                #The worker already tried other seeds too, so go on without this level
+                log.warning("skipping level %s: %s", args[5], error)
+                print("Couldn't generate level " + str(args[5]) + ", skipping it.")
+                self.all_maps.pop(0)
+                self.fill_queue()
+                continue
+            self.all_maps[0] = RandomGameMap.from_state(state, ids)
         if(not(len(self.all_maps))):
             #No more maps to play
             print("You win the game!")
+            self.stop_levels()
             sys.exit()
             return
         self.load_map(self.all_maps[0])
 
+    def stream_levels(self, levelcount, ahead = 2, jobs = 1, mode = "walk", seed = None, cache = None):
+        '''
+        Params: levelcount, ahead, jobs, mode, seed, cache (int, int, int, String, int, LevelCache)
+        Outputs: None
+        Replaces the queue with levelcount generated levels. Rather than building them all up front,
+        the next ahead levels are generated in jobs background processes while the current one is played.
+        The same seed always gives the same session.
+        '''
+        self.stop_levels()
+        self.all_maps = []
+        self.current_map = None
+        self.solved = []
+        self.ahead = ahead
+        self.pool = make_pool(jobs)
+        self.level_tasks = session_tasks(levelcount, mode, seed, cache)
+        self.fill_queue()
+
+    def fill_queue(self):
+        '''
+        Params: None
+        Outputs: None
+        Hands levels to the background pool until the current level plus ahead more are queued
+        '''
+        while(self.level_tasks and len(self.all_maps) <= self.ahead):
+            if(self.pack is not None):
+                number = self.level_tasks.pop(0)
+                self.add_map_to_queue(RandomGameMap.from_state(self.pack[number], number))
+            elif(self.pool is not None):
+                args = self.level_tasks.pop(0)
+                pending = self.pool.apply_async(stream_level, (args,))
+                self.level_args[pending] = args
+                self.add_map_to_queue(pending)
+            else:
+                break
+
+    def play_pack(self, pack, ahead = 2):
+        '''
+        Params: pack, ahead (LevelPack, int)
+        Outputs: None
+        Replaces the queue with the levels of a pack, in order. Levels are read from the pack as they're needed.
+        '''
+        self.stop_levels()
+        self.all_maps = []
+        self.current_map = None
+        self.solved = []
+        self.ahead = ahead
+        self.pack = pack
+        self.level_tasks = list(range(len(pack)))
+        self.fill_queue()
+
+    def stop_levels(self):
+        '''
+        Params: None
+        Outputs: None
+        Shuts down any background level generation
+        '''
+        if(self.pool is not None):
+            self.pool.terminate()
+            self.pool = None
+        if(self.pack is not None):
+            self.pack.close()
+            self.pack = None
+        self.level_tasks = []
+        self.level_args = {}
+
     def add_map_to_queue(self, mp):
         '''
-        Params: mp (Map)
+        Params: mp (Map or AsyncResult)
         Outputs: None
-        Adds a map to the queue
+        Adds a map, or a pending background result for one, to the queue
         '''
         if(not(mp in self.all_maps)):
             self.all_maps.append(mp)
@@ -115,10 +269,11 @@ class MapController():
         Outputs: None
         Debug function. Moves an object without running collision checks
         '''
-        print(tile)
+        log.debug("debug step from %s", tile)
         obj = tile.remove_from_tile()
         x, y = self.get_tile_coords(tile)
         self.current_map.tiles[x + dx][y + dy].add_to_tile(obj)
+        self.dirty.update((tile, self.current_map.tiles[x + dx][y + dy]))
 
     def try_step(self, dx, dy, tile, allow_recurse = 1):
         '''
@@ -127,16 +282,14 @@ class MapController():
         Tries to move an object, running collision checks. Allows recursion if allow_recurse > 0
         '''
         valid = True
-        self.moves += 1
+        pushed = False
         x, y = self.get_tile_coords(tile) 
         dest = self.current_map.tiles[x + dx][y + dy]
         if(len(dest.contents)): #Checking for boxes
             if(allow_recurse):
                 valid = self.try_step(dx, dy, dest, allow_recurse - 1)
-                if(valid):
-                    self.moves -= 1
+                pushed = valid
             else: #We can't push a box into a box or wall.
-                self.moves -= 1
                 valid = False
         if(not dest.obj_passable):
             #Trying to move into a wall
@@ -145,52 +298,137 @@ class MapController():
             #Valid move, move us forward
             obj = tile.remove_from_tile()
             dest.add_to_tile(obj)
-        self.check_map_completion()
+            self.dirty.update((tile, dest))
+            self.track(obj, tile, dest)
+            if(obj is self.current_map.player):
+                self.history.append(Directions.index((dx, dy)) | (Pushed if pushed else 0))
+                self.undone = bytearray()
+                self.moves += 1
+        if(allow_recurse):
+            #Only check once the whole move is done, not halfway through a push
+            self.check_map_completion()
         return valid
 
+    def shift_player(self, dx, dy, pushed, pulled):
+        '''
+        Params: dx, dy, pushed, pulled (int, int, bool, bool)
+        Outputs: None
+        Moves the player by dx, dy without any collision checks, for replaying the journal.
+        pushed moves the box in front of the player along with it, pulled drags the box behind it.
+        '''
+        tiles = self.current_map.tiles
+        tile = self.current_map.player.tile
+        x, y = tile.x, tile.y
+        dest = tiles[x + dx][y + dy]
+        if(pushed):
+            box = dest.remove_from_tile()
+            tiles[x + dx * 2][y + dy * 2].add_to_tile(box)
+            self.track(box, dest, tiles[x + dx * 2][y + dy * 2])
+            self.dirty.add(tiles[x + dx * 2][y + dy * 2])
+        player = tile.remove_from_tile()
+        dest.add_to_tile(player)
+        self.track(player, tile, dest)
+        if(pulled):
+            box = tiles[x - dx][y - dy].remove_from_tile()
+            tile.add_to_tile(box)
+            self.track(box, tiles[x - dx][y - dy], tile)
+            self.dirty.add(tiles[x - dx][y - dy])
+        self.dirty.update((tile, dest))
+
+    def track(self, obj, tile, dest):
+        '''
+        Params: obj, tile, dest (Box or Player, Tile, Tile)
+        Outputs: None
+        Updates position_hash for obj having moved from tile to dest
+        '''
+        width = self.current_map.width
+        table = self.zobrist.box if obj.name == "Box" else self.zobrist.player
+        self.position_hash ^= table[tile.x * width + tile.y] ^ table[dest.x * width + dest.y]
+
+    def undo(self):
+        '''
+        Params: None
+        Outputs: True or False
+        Takes back the last move, returns False if there was nothing to undo
+        '''
+        if(not self.history):
+            return False
+        code = self.history.pop()
+        dx, dy = Directions[code & 3]
+        self.shift_player(-dx, -dy, False, code & Pushed)
+        self.undone.append(code)
+        self.moves -= 1
+        return True
+
+    def redo(self):
+        '''
+        Params: None
+        Outputs: True or False
+        Replays the last undone move, returns False if there was nothing to redo
+        '''
+        if(not self.undone):
+            return False
+        code = self.undone.pop()
+        dx, dy = Directions[code & 3]
+        self.shift_player(dx, dy, code & Pushed, False)
+        self.history.append(code)
+        self.moves += 1
+        self.check_map_completion()
+        return True
+
+    def lurd(self):
+        '''
+        Params: None
+        Outputs: String
+        The moves made on the current map in LURD notation, lowercase for walks and uppercase for pushes
+        '''
+        return self.history.translate(LurdTable).decode("ascii")
+
+    def restart(self):
+        '''
+        Params: None
+        Outputs: None
+        Undoes every move on the current map. The moves can still be redone afterwards.
+        '''
+        while(self.undo()):
+            pass
+        self.moves = 0
+
     def get_tile_coords(self, tile):
         '''
         Params: tile (Tile)
         Outputs: row, col (int, int)
         Gets the coordinates of a given tile
         '''
-        for row in range(self.current_map.height):
-            for col in range(self.current_map.width):
-                if(self.current_map.tiles[row][col] == tile):
-                    return row, col
+        return tile.x, tile.y
 
 
     def get_obj_by_type(self, objtype):
         '''
         Params: objtype (Type)
         Outputs: i, col (Object, Tile)
-        Searches the map for an object with the given type
+        Looks up an object with the given type in the map's position index
         Returns that object and its tile
         '''
-        for row in self.current_map.tiles:
-            for col in row:
-                for i in col.contents:
-                    if(type(i) == objtype):
-                        return i, col
+        for i in [self.current_map.player] + self.current_map.boxes:
+            if(type(i) == objtype):
+                return i, i.tile
 
     def check_map_completion(self):
         '''
         Params: None
         Outputs: None
         Checks if all diamonds on the map are full
-        If they are, loads the next map
+        If they are, records the level's moves in solved and loads the next map
         '''
-        valid = True
-        completed = 0
-        for to_check in self.get_all_tiles_by_type(Diamond):
-            if(not to_check.check_full()):
-                valid = False
-            else:
-                completed += 1
-        if(valid):
-            print("YOU WIN!")
+        completed = self.current_map.filled
+        if(completed >= self.current_map.goalcount):
+            #Keep the recording, loading the next map clears the journal
+            self.solved.append((self.current_map.id, self.lurd()))
+            log.info("level %s complete in %d moves: %s", self.current_map.id, self.moves, self.solved[-1][1])
             self.load_next_map()
-        print("Boxes remaining: " + str(self.current_map.boxcount - completed))
+            return
+        log.debug("boxes remaining: %d", self.current_map.boxcount - completed)
         
 
     def get_all_tiles_by_type(self, tiletype):
@@ -213,7 +451,7 @@ class MapController():
     Find the tile that the player is currently located in, and return it.
     '''
         self.sync_player_loc()
-        return self.get_tile_by_coords(self.current_map.player.x_position, self.current_map.player.y_position)
+        return self.current_map.player.tile
 
     def get_tile_by_coords(self, x, y):
         '''
@@ -237,14 +475,14 @@ class MapController():
     Outputs: None
     Sets the player's internal x and y values to their actual values on the map.
     '''
-        p, c = self.get_obj_by_type(Player)
-        y, x = self.get_tile_coords(c)
-        p.y_position, p.x_position = y, x
+        p = self.current_map.player
+        p.y_position, p.x_position = p.tile.x, p.tile.y
 
 
 class Tile():
     '''
     Base tile object. Can contain objects.
+    x and y are the tile's row and column in the map.
     '''
     base_sprite = "."
     obj_passable = True
@@ -267,6 +505,7 @@ class Tile():
     '''
         if(obj not in self.contents and self.is_empty()):
             self.contents.append(obj)
+            obj.tile = self
             self.update_icon()
             return obj
         return False
@@ -327,10 +566,10 @@ class Diamond(Tile):
     #A passable diamond tile, while you need to get crates onto.'
     base_sprite = "U"
 
-    def __init__(self):
-        self.sprite = self.base_sprite
-        self.contents = []
+    def __init__(self, nx, ny, owner = None):
+        Tile.__init__(self, nx, ny)
         self.is_full = False
+        self.owner = owner #The map whose filled count this diamond keeps up to date
 
     def check_full(self):
         if(self.get_obj_by_name("Box")):
@@ -342,8 +581,10 @@ class Diamond(Tile):
     def add_to_tile(self, obj):
         if(obj not in self.contents and len(self.contents) == 0 and self.can_hold_objects):
             self.contents.append(obj)
+            obj.tile = self
             self.update_icon()
-            self.check_full()
+            if(self.check_full() and self.owner is not None):
+                self.owner.filled += 1
             return obj
         return False
     
@@ -361,6 +602,8 @@ class Diamond(Tile):
         if(len(self.contents) != 0):
             res = self.contents.pop(0)
             self.update_icon()
+            if(res.name == "Box" and self.owner is not None):
+                self.owner.filled -= 1
             self.check_full()
             return res
 
@@ -369,6 +612,7 @@ class Box():
     sprite = "O"
     name = "Box"
     diamond = None
+    tile = None #The tile this box is on, kept up to date by Tile.add_to_tile
 
     def __init__(self, d):
         self.diamond = d
@@ -377,6 +621,7 @@ class Player():
     #A player object
     sprite = "@"
     name = "Player"
+    tile = None #The tile the player is on, kept up to date by Tile.add_to_tile
 
     def __init__(self, x, y):
         self.x_position = x
@@ -393,12 +638,107 @@ class GameMap():
         self.source = s
         #self.load_template(source)
 
+    def materialise(self):
+        #Maps that build their Tiles lazily override this
+        pass
+
+class GenerationStats():
+    '''
+    Where a RandomGameMap's generation time went.
+    attempts holds one record per attempt: the last phase it reached, why it was
+    rejected (None for the accepted one) and the seconds spent in each phase.
+    '''
+
+    def __init__(self):
+        self.attempts = []
+        self.phase_start = 0
+
+    def start_attempt(self):
+        '''
+    Params: None
+    Outputs: None
+    Opens a new attempt record
+    '''
+        self.attempts.append({"phase": None, "reason": None, "times": {}})
+
+    def enter(self, phase):
+        '''
+    Params: phase (String)
+    Outputs: None
+    Charges the time since the last call to the current phase, then moves on to the given one
+    '''
+        now = time.perf_counter()
+        record = self.attempts[-1]
+        if(record["phase"] is not None):
+            times = record["times"]
+            times[record["phase"]] = times.get(record["phase"], 0) + now - self.phase_start
+            log.debug("attempt %d %s phase took %.3f ms", len(self.attempts), record["phase"], (now - self.phase_start) * 1000)
+        record["phase"] = phase
+        self.phase_start = now
+
+    def finish_attempt(self, reason):
+        '''
+    Params: reason (String or None)
+    Outputs: None
+    Closes the current attempt, recording why it was rejected
+    '''
+        phase = self.attempts[-1]["phase"]
+        self.enter(phase)
+        self.attempts[-1]["reason"] = reason
+
+    def rejections(self):
+        '''
+    Params: None
+    Outputs: counts (dict)
+    How many attempts were rejected for each reason
+    '''
+        counts = {}
+        for record in self.attempts:
+            if(record["reason"] is not None):
+                counts[record["reason"]] = counts.get(record["reason"], 0) + 1
+        return counts
+
+    def phase_times(self):
+        '''
+    Params: None
+    Outputs: totals (dict)
+    Total seconds spent in each phase across all attempts
+    '''
+        totals = {}
+        for record in self.attempts:
+            for phase, spent in record["times"].items():
+                totals[phase] = totals.get(phase, 0) + spent
+        return totals
+
+    def __str__(self):
+        times = ", ".join("%s %.3fs" % (phase, spent) for phase, spent in self.phase_times().items())
+        return "%d attempts, rejections: %s, time: %s" % (len(self.attempts), self.rejections(), times)
+
 class RandomGameMap(GameMap):
     #Randomised game map. This is where things get interesting.
+    max_attempts = 1000 #Attempts generate() makes before giving up
+    path_retry_factor = 10 #makepath gives up after difficulty * this many steps
+    box_retry_factor = 6 #Each box gets boxcount * this many placement tries
+    check_nodes = 10 #Solver nodes per box a walk-mode attempt's check may use
+    check_budget = 40 #Solver nodes per box for all of a map's walk-mode checks together
+    walk_attempts = 10 #Walk-mode attempts before the rest pull instead, see generate
+    solver_nodes = 0 #Solver nodes spent on this map's checks so far
+    stats = None #GenerationStats for the last call to generate
+    solution = None #Pushes that solve the map, as (cell, delta) pairs over flat cell indices
     tiles = []
     waypoints = []
-
-    def __init__(self, h, w, b, wc, d, ids):
+    boxes = [] #Every Box on the map, each one knows its own tile
+    filled = 0 #Diamonds currently holding a box, kept up to date by Diamond
+    goalcount = 0 #Total number of diamonds
+    seed = None #Seed the map was generated from, None for maps that weren't
+    random = None #This map's own random.Random, seeded with seed
+    level_hash = None #Canonical Zobrist hash of the level as it starts, the same for duplicate levels
+    layout_batch = 8 #Wall layouts drawn at once, see layout.layouts
+    layouts = None #Layouts drawn but not yet tried
+    layout_random = None #Draws only the wall lines, one attempt after another, so layout_batch doesn't change which map a seed makes
+    start = None #State the map starts from while it has no Tiles, see materialise
+
+    def __init__(self, h, w, b, wc, d, ids, mode = "walk", seed = None):
         self.height = h
         self.width = w
         self.moves = 0
@@ -406,112 +746,89 @@ class RandomGameMap(GameMap):
         self.wallcount = wc
         self.difficulty = d
         self.id = ids
+        self.mode = mode #"walk" moves boxes around at random and asks the solver, "pull" plays the level backwards, see generate
         self.player = None
+        #Same seed and settings, same map. Each map has its own generator, so maps can be built side by side
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.random = random.Random(self.seed)
+        self.layout_random = random.Random("walls %d" % self.seed)
+        self.layouts = []
         self.generate()
 
-    def get_line(self, x1, y1, x2, y2):
-        '''
-    Params: x1, y1, x2, y2 (int, int, int, int)
-    returns: List of tiles
-    Attempts to draw a random line, on the game map.
-    '''
-        res = []
-        #Difference between the x and y coordinates
-        diffx = x2 - x1
-        diffy = y2 - y1
-        #Total number of tiles to select
-        steps = (abs(diffx) + abs(diffy))
-        curx = x1
-        cury = y1
-        #Difference per x/y coordinate
-        diffsx = diffx / steps
-        diffsy = diffy / steps
-        '''
-        print("DEBUG START")
-        print("X coordinate 1: " + str(x1))
-        print("X coordinate 2: " + str(x2))
-        print("Y coordinate 1: " + str(y1))
-        print("Y coordinate 2: " + str(y2))
-        print("X coordinate difference: " + str(diffx))
-        print("Y coordinate difference: " + str(diffy))
-        print("Total steps: " + str(steps))
-        print("Current X coordinate: " + str(curx))
-        print("Current Y coordinate: " + str(cury))
-        print("X difference per step: " + str(diffsx))
-        print("Y difference per step: " + str(diffsy))
-   '''
-        for it in range(steps):
-            #print("Step " + str(it) + ": X coordinate: " + str(int(round(curx))))
-            #print("Step " + str(it) + ": Y coordinate: " + str(int(round(cury))))
-            curx += diffsx
-            cury += diffsy
-            res.append(self.tiles[int(round(cury))][int(round(curx))])
-        #print("DEBUG END")
-        return res
-
-    def reject(self):
-        #'This map is unsolveable, try again.
-        print("REJECTING")
-        self.tiles = None
-        self.generate()
-    
     def generate(self):
+        '''
+    Params: None
+    Outputs: None
+    Keeps making attempts at a map until one passes every check, recording how each went in self.stats.
+    Walk mode can only keep maps the solver gets through, which gets less likely as boxes are added,
+    so after walk_attempts attempts or check_budget solver nodes per box it switches to pull mode,
+    whose maps are solvable by construction. Both limits count work rather than time, so a seed
+    still always makes the same map. Gives up with a RuntimeError after max_attempts.
+    '''
+        self.stats = GenerationStats()
+        self.solver_nodes = 0
+        with span("generating level %s (%s mode, seed %s)", self.id, self.mode, self.seed):
+            while(len(self.stats.attempts) < self.max_attempts):
+                if(self.mode == "walk" and (len(self.stats.attempts) >= self.walk_attempts or self.solver_nodes >= self.check_budget * self.boxcount)):
+                    log.info("level %s: switching to pull mode after %d attempts and %d solver nodes", self.id, len(self.stats.attempts), self.solver_nodes)
+                    self.mode = "pull"
+                self.stats.start_attempt()
+                reason = self.attempt()
+                self.stats.finish_attempt(reason)
+                if(reason is None):
+                    self.level_hash = self.to_state().canonical_hash()
+                    log.info("level %s: %s", self.id, self.stats)
+                    return
+                log.info("rejecting attempt %d: %s", len(self.stats.attempts), reason)
+                self.tiles = None
+        log.warning("level %s: %s", self.id, self.stats)
+        raise RuntimeError("Couldn't generate a map in %d attempts" % self.max_attempts)
+
+    def attempt(self):
+        '''
+    Params: None
+    Outputs: reason (String or None)
+    Makes a single attempt at generating the map.
+    Returns None if it worked, otherwise why the attempt was rejected.
+    '''
         #'Oh god here we go.
         #Generate the base map
+        self.stats.enter("walls")
         self.waypoints = []
-        self.tiles = [[Tile(x,y) for x in range(self.width)] for y in range(self.height)]
-        for row_no, row in enumerate(self.tiles):
-            for col_no, col in enumerate(row):
-                if(row_no == 0 or col_no == 0 or row_no == self.height - 1 or col_no == self.width - 1):
-                    self.place_tile(row_no, col_no, Wall(row_no, col_no))
-
-        #Draws random walls
-        for wall in range(self.wallcount):
-            valid = False
-            rand1x = 0
-            rand1y = 0
-            rand2x = 0
-            rand2y = 0
-            while(valid == False):
-                randx = random.randint(1, self.height - 1)
-                randy = random.randint(1, self.width - 1)
-                startpos = self.tiles[randx][randy]
-                #Reuse the same variables, for effiency
-                rand1x, rand1y = randx, randy
-                randx = random.randint(1, self.height - 1)
-                randy = random.randint(1, self.width - 1)
-                endpos = self.tiles[randx][randy]
-                rand2x, rand2y = randx, randy
-                if(startpos == endpos):
-                    continue
-                valid = True
-            path = self.get_line(rand1x, rand1y, rand2x, rand2y)
-            for t in path:
-                try:
-                    x, y = t.x, t.y
-                except:
-                    #Something went wrong, CODE RED ABORT ABORT
-                    self.reject()
-                    return
-                self.tiles[x][y] = Wall(x,y)
+        self.boxes = []
+        self.filled = 0
+        self.start = None
+        #Border and random wall lines, drawn layout_batch attempts at a time and tried in the order drawn, see layout.py
+        if(not self.layouts):
+            self.layouts = layouts(self.layout_random, self.layout_batch, self.height, self.width, self.wallcount)[::-1]
+        layout = self.layouts.pop()
+
+        self.stats.enter("boxes")
+        if(self.mode == "pull"):
+            #Works on the layout directly, Tiles are only made if the map is played, see materialise
+            self.tiles = None
+            return self.pull_boxes(Board(self.height, self.width, wall_bits(layout), 0))
+        self.tiles = [[Wall(row, col) if layout[row * self.width + col] else Tile(row, col) for col in range(self.width)] for row in range(self.height)]
+        #The walls are fixed from here on, so the dead squares only change as diamonds are placed
+        deadlocks = Deadlocks(Board(self.height, self.width, wall_bits(layout), 0))
 
         #Place the player. Somewhere.
         valid = False
         playertile = None
         while(valid == False):
-            playertile = self.tiles[random.randint(1, self.height -1)][random.randint(1, self.width - 1)]
+            playertile = self.tiles[self.random.randint(1, self.height -1)][self.random.randint(1, self.width - 1)]
             valid = playertile.add_to_tile(Player(1,1))
             self.player = valid
-            random.seed()
         waypoints = [playertile]
         #tiles_to_check = [roaming_pos] #Tiles to attempt to pathfind between
 
-        def makepath(tile):
+        def makepath(tile, deadlocks):
             #print("STARTING PATH CALCULATION")
             start_point = tile
             line_length = self.difficulty
             startbox = Box(start_point)
             start_point.add_to_tile(startbox)
+            self.boxes.append(startbox)
             step = 0
             path = [start_point]
             next_point = 0
@@ -521,23 +838,29 @@ class RandomGameMap(GameMap):
                 #time.sleep(0.025)
                 #print(str(self))
                 tries += 1
-                if(tries > self.difficulty * 10):
+                if(tries > self.difficulty * self.path_retry_factor):
                     path[-1].remove_from_tile()
+                    self.boxes.remove(startbox)
                     #OH GOD ABORT IT'S ALL ON FIRE
                     return False, False, False, False
                 dx = 0
                 dy = 0
-                x_or_y = random.choice((1,2))
+                x_or_y = self.random.choice((1,2))
                 if(x_or_y == 1):
-                    dx = random.choice((1,-1))
+                    dx = self.random.choice((1,-1))
                 else:
-                    dy = random.choice((1,-1))
+                    dy = self.random.choice((1,-1))
                 #print("STEP: " + str(step))
                 try_add, next_tile = self.try_step(dx,dy,path[-1])
                 if(try_add):
                     #print("PROGRESSING")
                     path.append(try_add)
                     step += 1
+                    #Don't let the walk finish somewhere the box is dead or frozen
+                    if(step == line_length and deadlocks.deadlocked(self.box_bits(), try_add.x * self.width + try_add.y)):
+                        path[-2].add_to_tile(path[-1].remove_from_tile())
+                        path.pop(-1)
+                        step -= 1
                 else:
                     if(len(path) > 1):
                         #print("REGRESSING")
@@ -554,22 +877,21 @@ class RandomGameMap(GameMap):
             tries = 0
             ovalid = False #I just realised that this looks like something else entirely
             while(ovalid == False):
-                if(tries > self.boxcount * 6):
+                if(tries > self.boxcount * self.box_retry_factor):
                     #As usual, it's all gone wrong oh god send the fire brigade
                     #Seriously though, this is here to prevent an infinite loop.
-                    self.reject()
-                    return False
+                    return "ran out of box placement tries"
                 valid = False
                 randx = 0
                 randy = 0
                 while(valid == False):
-                    randx = random.randint(1, self.height-1)
-                    randy = random.randint(1, self.width-1)
-                    if(not(len(self.tiles[randx][randy].contents)) and (self.tiles[randx][randy].can_hold_objects)):
-                        self.tiles[randx][randy] = Diamond()
+                    randx = self.random.randint(1, self.height-1)
+                    randy = self.random.randint(1, self.width-1)
+                    if(not(len(self.tiles[randx][randy].contents)) and (self.tiles[randx][randy].can_hold_objects) and type(self.tiles[randx][randy]) != Diamond):
+                        self.tiles[randx][randy] = Diamond(randx, randy, self)
                         valid = True
-                    random.seed()
-                path, endpoint, startpoint, temp_box = makepath(self.get_tile(randx,randy))
+                revived = deadlocks.add_goal(randx * self.width + randy)
+                path, endpoint, startpoint, temp_box = makepath(self.get_tile(randx,randy), deadlocks)
                 if(path):
                     waypoints.append(startpoint)
                     waypoints.append(endpoint)
@@ -578,6 +900,7 @@ class RandomGameMap(GameMap):
                 else:
                     tries += 1
                     self.tiles[randx][randy] = Tile(randx, randy)
+                    deadlocks.remove_goal(randx * self.width + randy, revived)
 
         #Try and make sure the level can be solved. Emphasis on try.
         check_box_count = 0
@@ -586,89 +909,95 @@ class RandomGameMap(GameMap):
             for r in range(self.width):
                 if(len(self.tiles[l][r].contents)):
                     if(type(self.tiles[l][r].contents[0]) == Box):
-                        '''
-                        if((self.is_not_passable(l+1, r) and self.is_not_passable(l, r+1))\
-                           or (self.is_not_passable(l+1, r) and self.is_not_passable(l, r-1))\
-                           or (self.is_not_passable(l-1, r) and self.is_not_passable(l, r+1))\
-                           or (self.is_not_passable(l-1, r) and self.is_not_passable(l, r-1))):
-                            
-
-                            self.reject()
-    
-                            return
-                        '''
                         check_box_count += 1
                 if(type(self.tiles[l][r]) == Diamond):
                     check_diamond_count += 1
         if(not(check_box_count == check_diamond_count)):
             #We somehow generated too many boxes, abort.
-            self.reject()
-            return
-
-        #Create a grid out of the tiles 2d array
-        resgrid = Grid(matrix=self.convert_to_grid(self.tiles))
-        finder = AStarFinder(diagonal_movement = DiagonalMovement.never)
-
-        #Create a copy of the waypoints list and remove any errored waypoints
-        for point in waypoints[:]:
-            print("X: ", point.x, "Y:", point.y)
-            if(point.x == 0 and point.y == 0):
-                print("oops")
-                waypoints.remove(point)
-        
-        def get_node(to_node):
-            coordx, coordy = to_node.x, to_node.y
-            return resgrid.node(coordx, coordy)
-
-        #Turn the waypoints list into a list of nodes
-        nodes = []
-        for pos in range(len(waypoints)):
-            nodes.append(get_node(waypoints[pos]))
-
-        '''
-        path, runs = finder.find_path(playerpos, nodes[0], resgrid)
-        if(len(path) == 0):
-            self.reject()
-            return 
-        print("operations",runs,"path length:", len(path))
+            return "box and diamond counts differ"
+        self.goalcount = check_diamond_count
+
+        self.stats.enter("paths")
+        #Label every walkable region once, then every waypoint has to share the player's region
+        labels = self.to_state().board.regions()
+        region = labels[waypoints[0].x * self.width + waypoints[0].y]
+        for point in waypoints:
+            if(labels[point.x * self.width + point.y] != region):
+                return "waypoints not connected"
+
+        #Walkability isn't enough, make sure every box can be pushed onto a diamond
+        self.stats.enter("solve")
+        budget = self.check_budget * self.boxcount - self.solver_nodes
+        result = solve(self, min(self.check_nodes * self.boxcount, budget))
+        self.solver_nodes += result.nodes
+        if(result.status != SOLVED):
+            return "solver: " + result.status
+        self.solution = result.pushes
+        return None
+
+    def pull_boxes(self, board):
         '''
-
-        for node_index in range(len(nodes)):
-            if(node_index + 1 <= len(nodes)-1):
-                resgrid.cleanup()
-
-                path, runs = finder.find_path(nodes[node_index], nodes[node_index + 1], resgrid)
-                print(resgrid.grid_str(path=path, start=nodes[node_index], end=nodes[node_index + 1]))
-                print("operations",runs,"path length:", len(path))
-
-                if(len(path) == 0):
-                    self.reject()
-                    return
+    Params: board (Board)
+    Outputs: reason (String or None)
+    Reverse-play generation. Starts from the solved position, with every box on its diamond,
+    then has the player walk to and pull a box difficulty * boxcount times.
+    Played forwards the pulls are a solution, so the map is solvable by construction.
+    The finished map is left in self.start, without building any Tiles.
+    '''
+        walls = board.wall_array()
+        deltas = board.deltas()
+        labels = board.regions()
+        #Play in the biggest walkable region, so every box can be reached
+        sizes = {}
+        for cell in range(len(walls)):
+            if(labels[cell]):
+                sizes[labels[cell]] = sizes.get(labels[cell], 0) + 1
+        biggest = max(sizes, key = sizes.get)
+        region = [cell for cell in range(len(walls)) if labels[cell] == biggest]
+        if(len(region) <= self.boxcount):
+            return "region too small"
+        self.random.shuffle(region)
+        player = region.pop()
+        goals = sum(1 << cell for cell in region[:self.boxcount])
+        boxes = goals
+        pulls = []
+        last = None
+        for pull in range(self.difficulty * self.boxcount):
+            seen = reachable(walls, deltas, player, boxes)
+            options = []
+            for box in bit_cells(boxes):
+                for d in deltas:
+                    #The player stands on box + d and backs away to box + 2d, dragging the box along
+                    stand = box + d
+                    if(seen[stand] and not walls[stand + d] and not (boxes >> (stand + d)) & 1):
+                        options.append((box, d))
+            if(not options):
+                break
+            #Mostly keep dragging the same box, which makes for longer box paths
+            follow = [option for option in options if option[0] == last]
+            box, d = self.random.choice(follow if follow and self.random.random() < 0.75 else options)
+            boxes ^= (1 << box) | (1 << (box + d))
+            player = box + 2 * d
+            last = box + d
+            pulls.append((box, d))
+        if(len(pulls) < self.difficulty):
+            return "player boxed in"
+        if(not (goals & ~boxes)):
+            return "no box left its diamond"
+        #The player can finish anywhere it could have walked to
+        seen = reachable(walls, deltas, player, boxes)
+        player = self.random.choice([cell for cell in range(len(walls)) if seen[cell]])
+        self.start = State(Board(board.height, board.width, board.walls, goals), boxes, player).normalised()
+        #Each pull, played forwards, is a push of the box from box + d back to box
+        self.solution = [(box + d, -d) for box, d in reversed(pulls)]
+        return None
         
 
     
 
 
-    def convert_to_grid(self, to_grid):
-        results = [];
-        temp = [];
-        for indexh in range(self.height):
-            temp = [];
-            for indexw in range(self.width):
-                char = str(to_grid[indexh][indexw])
-                conv_char = "0" if char in ["#"] else "1"
-                temp.append(conv_char)
-            results.append(temp)
-            print(temp)
-        return results
-            
-
-    #deprecated
     def get_tile_coords(self, tile):
-        for row in range(self.height):
-            for col in range(self.width):
-                if(self.tiles[row][col] == tile):
-                    return row, col
+        return tile.x, tile.y
 
     def try_step(self, dx, dy, tile):
         valid = True
@@ -703,34 +1032,102 @@ class RandomGameMap(GameMap):
             return(len(self.get_tile(x,y).contents))
         return False
     
-    '''
-    def check_box_pos_validity(self, pos):
-        x, y = self.get_tile_coords(pos)
-        print(str(self.get_tile(x, y)))
-        if(self.is_not_passable(x, y)):
-            print("Target tile is not passable")
-            return False
-        if((self.is_not_passable(x+1, y) and self.is_not_passable(x, y+1))\
-           or (self.is_not_passable(x+1, y) and self.is_not_passable(x, y-1))\
-           or (self.is_not_passable(x-1, y) and self.is_not_passable(x, y+1))\
-           or (self.is_not_passable(x-1, y) and self.is_not_passable(x, y-1))):
-            print("Corner tiles aren't passable")
-            return False
-        if(type(self.get_tile(x,y)) == Diamond):
-            print("Cannot place on diamond")
-            return False
-        return True
-
+    def get_tile(self, x, y):
+        return self.tiles[x][y]
 
+    def replay(self, moves):
+        '''
+    Params: moves (String)
+    Outputs: solved, applied (bool, int)
+    Plays a LURD recording against this map's compact state, leaving the map itself alone.
+    applied is how many moves were legal, see state.replay.
     '''
+        solved, applied, final = replay(self.to_state(), moves)
+        return solved, applied
 
-    def get_tile(self, x, y):
-        return self.tiles[x][y]
+    def box_bits(self):
+        '''
+    Params: None
+    Outputs: int
+    The boxes as a bitset over flat cell indices, read from the position index.
+    '''
+        return sum(1 << (box.tile.x * self.width + box.tile.y) for box in self.boxes)
 
     def place_tile(self, x, y, tile):
         self.tiles[x][y] = tile
 
+    def to_state(self):
+        '''
+    Params: None
+    Outputs: State
+    Packs this map into a compact State, normalised so it matches what reading the level back from a pack gives.
+    '''
+        if(self.tiles is None):
+            return self.start
+        return State.from_map(self).normalised()
+
+    def materialise(self):
+        '''
+    Params: None
+    Outputs: None
+    Builds the Tiles for a map that was generated without them.
+    '''
+        if(self.tiles is None and self.start is not None):
+            self.load_state(self.start)
+
+    def load_state(self, state):
+        '''
+    Params: state (State)
+    Outputs: None
+    Rebuilds this map's tiles from a compact State.
+    '''
+        board = state.board
+        self.height = board.height
+        self.width = board.width
+        self.boxes = []
+        self.filled = 0
+        self.goalcount = 0
+        self.tiles = []
+        for row in range(self.height):
+            self.tiles.append([])
+            for col in range(self.width):
+                index = board.index(row, col)
+                if((board.walls >> index) & 1):
+                    tile = Wall(row, col)
+                elif((board.goals >> index) & 1):
+                    tile = Diamond(row, col, self)
+                    self.goalcount += 1
+                else:
+                    tile = Tile(row, col)
+                if(state.has_box(index)):
+                    self.boxes.append(tile.add_to_tile(Box(None)))
+                elif(index == state.player):
+                    self.player = tile.add_to_tile(Player(col, row))
+                self.tiles[row].append(tile)
+        self.boxcount = state.box_count()
+
+    @classmethod
+    def from_state(cls, state, ids = 0):
+        '''
+    Params: state, ids (State, int)
+    Outputs: RandomGameMap
+    Builds a playable map from a compact State, without generating anything.
+    '''
+        mp = cls.__new__(cls)
+        mp.moves = 0
+        mp.wallcount = 0
+        mp.difficulty = 0
+        mp.id = ids
+        mp.mode = "walk"
+        mp.seed = None
+        mp.player = None
+        mp.waypoints = []
+        mp.load_state(state)
+        mp.level_hash = state.canonical_hash()
+        return mp
+
     def __str__(self):
+        self.materialise()
         result = ""
         count = 0
         for ti in self.tiles:
@@ -756,69 +1153,223 @@ def move(char):
 
 mc = MapController()
 
-def loadMapDisplay(half):
-    global DISPLAYSURF
-    mapSurf = pygame.Surface((half*2, half*2))
-    pygame.display.get_surface().fill(BgColour)
-    mapSurf.fill(BgColour)
+GeneratorVersion = 3 #Part of every LevelCache key. Bump it when a seed would make a different level, so stale ones aren't reused
+
+def level_params(i):
+    '''
+    Params: i (int)
+    Outputs: h, w, b, wc, d, ids
+    The RandomGameMap arguments for the i'th level of a session. Levels get bigger and harder as i grows.
+    '''
+    return round(10+(i*1.15)),round(10+(i*1.15)),5+i*3,round(3+(i*0.75)),14+(i*5),i
+
+def session_tasks(levelcount, mode = "walk", seed = None, cache = None):
+    '''
+    Params: levelcount, mode, seed, cache (int, String, int, LevelCache)
+    Outputs: list of build_level arguments
+    Gives every level of a session its own seed, all drawn from seed (a random one if None).
+    '''
+    session = random.Random(seed)
+    return [level_params(i) + (session.randrange(2**32), mode, cache) for i in range(levelcount)]
+
+def build_level(args):
+    '''
+    Params: args (tuple of level_params + seed, mode, cache)
+    Outputs: ids, state (int, State)
+    Process pool worker. Generates one level and sends it back as a compact, picklable State.
+    Levels already in cache are returned straight away.
+    '''
+    h, w, b, wc, d, ids, seed, mode, cache = args
+    key = (GeneratorVersion, seed, h, w, b, wc, d, mode, RandomGameMap.layout_batch)
+    state = cache.get(key) if cache is not None else None
+    if(state is None):
+        state = RandomGameMap(h, w, b, wc, d, ids, mode, seed).to_state()
+        if(cache is not None):
+            cache.put(key, state)
+    return ids, state
+
+def stream_level(args, tries = 10):
+    '''
+    Params: args, tries (build_level arguments, int)
+    Outputs: ids, state (int, State)
+    Process pool worker behind MapController.stream_levels. Like build_level, but if the seed runs out
+    of attempts it goes on to retry_level, so that happens in the background too.
+    '''
+    try:
+        return build_level(args)
+    except RuntimeError as error:
+        log.warning("level %s: %s, retrying with new seeds", args[5], error)
+        return retry_level(args, tries)
+
+def retry_level(args, tries = 10):
+    '''
+    Params: args, tries (build_level arguments, int)
+    Outputs: ids, state (int, State)
+    Builds a level whose seed ran out of attempts, drawing new seeds from the old one until one works.
+    Gives up with a RuntimeError after tries more seeds.
+    '''
+    h, w, b, wc, d, ids, seed, mode, cache = args
+    reseed = random.Random(seed)
+    for attempt in range(tries):
+        try:
+            return build_level((h, w, b, wc, d, ids, reseed.randrange(2**32), mode, cache))
+        except RuntimeError as error:
+            log.warning("level %s: %s", ids, error)
+    raise RuntimeError("Couldn't generate level %s from %d seeds" % (ids, tries + 1))
+
+def make_pool(jobs = None):
+    '''
+    Params: jobs (int)
+    Outputs: Pool
+    A process pool for level generation, with jobs workers (one per core if None).
+    '''
+    #Workers inherit SDL's SIGTERM handler, which would stop the pool from shutting them down
+    return multiprocessing.Pool(jobs, signal.signal, (signal.SIGTERM, signal.SIG_DFL))
+
+def generate_states(levelcount, jobs = None, mode = "walk", seed = None, cache = None):
+    '''
+    Params: levelcount, jobs, mode, seed, cache (int, int, String, int, LevelCache)
+    Outputs: generator of (ids, State)
+    Builds a session's levels across a pool of jobs processes (one per core if None), yielding them in order
+    as the compact States the workers send back. Levels don't depend on each other, so each worker just gets its own seed.
+    '''
+    with make_pool(jobs) as pool:
+        for ids, state in pool.imap(build_level, session_tasks(levelcount, mode, seed, cache)):
+            yield ids, state
+
+def generate_levels(levelcount, jobs = None, mode = "walk", seed = None, cache = None):
+    '''
+    Params: levelcount, jobs, mode, seed, cache (int, int, String, int, LevelCache)
+    Outputs: generator of RandomGameMap
+    generate_states, with each level made playable.
+    '''
+    for ids, state in generate_states(levelcount, jobs, mode, seed, cache):
+        yield RandomGameMap.from_state(state, ids)
+
+def export_pack(path, levelcount, jobs = None, mode = "walk", seed = None, cache = None):
+    '''
+    Params: path, levelcount, jobs, mode, seed, cache (String, int, int, String, int, LevelCache)
+    Outputs: count (int)
+    Generates a session's levels and saves them as an XSB pack that main can play later, or other Sokoban programs can open.
+    Any level that comes out the same as an earlier one is left out.
+    '''
+    return write_pack(path, (state for ids, state in generate_states(levelcount, jobs, mode, seed, cache)), True)
+
+def solve_pack(path, jobs = None, max_nodes = 50000):
+    '''
+    Params: path, jobs, max_nodes (String, int, int)
+    Outputs: generator of (int, SolverResult)
+    Solves the levels of an XSB pack one after another, each one searched by jobs processes (None means one per core).
+    '''
+    with LevelPack(path) as pack:
+        for number in range(len(pack)):
+            yield number, ParallelSolver(pack[number], jobs, max_nodes).solve()
+
+LabelRect = None #Where the move counter was last drawn
+
+def loadMapDisplay():
+    global DISPLAYSURF, LabelRect
     mapSurf = mc.drawMap()
     mapSurfRect = mapSurf.get_rect()
-    mapSurfRect.center = (half, half)
-    DISPLAYSURF.blit(mapSurf, mapSurfRect)
-    label = myfont.render(str(mc.moves), 1, (255,255,255))
-    DISPLAYSURF.blit(label, (0, 0))
-    pygame.display.update()
-    FPSClock.tick()
-
-def main():
+    screenRect = DISPLAYSURF.get_rect()
+    if(mc.changed is None and not screenRect.contains(mapSurfRect)):
+        #Pack levels aren't sized by level number, so grow the window to fit
+        size = max(screenRect.width, screenRect.height, mapSurfRect.width, mapSurfRect.height)
+        DISPLAYSURF = pygame.display.set_mode((size, size))
+        LabelRect = None
+    mapSurfRect.center = DISPLAYSURF.get_rect().center
+    if(mc.changed is None):
+        #New level, redraw the whole screen
+        DISPLAYSURF.fill(BgColour)
+        DISPLAYSURF.blit(mapSurf, mapSurfRect)
+        rects = None
+    else:
+        rects = []
+        for area in mc.changed:
+            screenRect = area.move(mapSurfRect.topleft)
+            DISPLAYSURF.blit(mapSurf, screenRect, area)
+            rects.append(screenRect)
+    if(rects is None or rects):
+        if(LabelRect is not None):
+            DISPLAYSURF.fill(BgColour, LabelRect)
+        label = myfont.render(str(mc.moves), 1, (255,255,255))
+        newRect = DISPLAYSURF.blit(label, (0, 0))
+        if(rects is not None):
+            rects.append(newRect.union(LabelRect) if LabelRect is not None else newRect)
+        LabelRect = newRect
+    if(rects is None):
+        pygame.display.update()
+    elif(rects):
+        pygame.display.update(rects)
+    FPSClock.tick(FPS)
+
+def main(jobs = 1, ahead = 2, mode = "walk", pack = None, seed = None, cache = None):
+    '''
+    Params: jobs, ahead, mode, pack, seed, cache (int, int, String, String, int, LevelCache)
+    Outputs: None
+    Runs the game. Levels are generated in jobs background processes (0 means one per core),
+    keeping ahead levels ready behind the one being played. mode picks the RandomGameMap generator.
+    If pack is the path of an XSB pack its levels are played instead of generating any.
+    seed fixes the session's levels, and generated levels are kept in cache if one is given.
+    '''
     global DISPLAYSURF
-
-    valid = False
-    mp = None
-    levelcount = int(input("Please enter the total number of levels."))
-    screensize = 32 * (10 + round(levelcount * 1.25))
-    print(screensize)
+    load_assets()
+    from pygame.locals import QUIT, VIDEOEXPOSE, KEYDOWN, K_RIGHT, K_UP, K_LEFT, K_DOWN, K_w, K_a, K_s, K_d, K_SPACE, K_z, K_y, K_r, K_BACKSPACE
+
+    if(pack is None):
+        levelcount = int(input("Please enter the total number of levels."))
+        screensize = 32 * (10 + round(levelcount * 1.25))
+    else:
+        screensize = 32 * 10 #loadMapDisplay grows this to fit each level
+    log.debug("screen size %d", screensize)
     DISPLAYSURF = pygame.display.set_mode((screensize, screensize))
-    for i in range(levelcount):
-        valid = False
-        while(valid == False):
-            pygame.event.get()
-            mp = RandomGameMap(round(10+(i*1.15)),round(10+(i*1.15)),5+i*3,round(3+(i*0.75)),14+(i*5),i)
-            print(str(mp))
-            mc.load_map(mp)
-            loadMapDisplay(screensize/2)
-            v = int(input("Please enter 1 if there are no crates, boxes or players in blocked-off sections on this level, and that all boxes are accessible, otherwise 0"))
-            if(v == 1):
-                valid = True
-        mc.add_map_to_queue(mp)
-
+    if(pack is None):
+        #RandomGameMap only returns once the solver has verified the map
+        mc.stream_levels(levelcount, ahead, jobs or None, mode, seed, cache)
+    else:
+        mc.play_pack(LevelPack(pack), ahead)
     mc.load_next_map()
-    mapcopy = deepcopy(mc.current_map)
+    changed = True
     while(True):
-        loadMapDisplay(screensize/2)
-
-        if(mapcopy.id != mc.current_map.id):
-            mapcopy = deepcopy(mc.current_map)
-        print("Moves: " + str(mc.moves))
-        print(str(mc.current_map))
-        for event in pygame.event.get():
-            if event.type == KEYDOWN:
-                if event.key == K_RIGHT or event.key == K_d:
-                    move("s")
-                elif event.key == K_UP or event.key == K_w:
-                    move("a")
-                elif event.key == K_LEFT or event.key == K_a:
-                    move("w")
-                elif event.key == K_DOWN or event.key == K_s:
-                    move("d")
-                elif event.key == K_SPACE:
-                    mc.load_map(deepcopy(mapcopy))
-                elif event.key == K_r:
-                    main()
-                    return
-                else:
-                    pass
-                break
+        if(changed):
+            #Only redraw when something happened, loadMapDisplay caps this at FPS
+            with span("frame"):
+                loadMapDisplay()
+            log.debug("moves: %d", mc.moves)
+            log.debug("map:\n%s", mc.current_map)
+            changed = False
+
+        #Sleep until there's something to do, rather than spinning on event.get()
+        event = pygame.event.wait()
+        if event.type == QUIT:
+            mc.stop_levels()
+            pygame.quit()
+            sys.exit()
+        elif event.type == VIDEOEXPOSE:
+            mc.background = None
+            changed = True
+        elif event.type == KEYDOWN:
+            changed = True
+            if event.key == K_RIGHT or event.key == K_d:
+                move("s")
+            elif event.key == K_UP or event.key == K_w:
+                move("a")
+            elif event.key == K_LEFT or event.key == K_a:
+                move("w")
+            elif event.key == K_DOWN or event.key == K_s:
+                move("d")
+            elif event.key == K_SPACE:
+                mc.restart()
+            elif event.key == K_z or event.key == K_BACKSPACE:
+                mc.undo()
+            elif event.key == K_y:
+                mc.redo()
+            elif event.key == K_r:
+                #A fixed seed would just give the same levels again
+                main(jobs, ahead, mode, pack, None, cache)
+                return
+            else:
+                changed = False
         #if(move(input(">>")) == "Restart"):
             #mc.load_map(deepcopy(mapcopy))
 
@@ -830,4 +1381,30 @@ mc = MapController()
 mc.load_map(mp)
 print(str(mp))
 '''
-main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sokoblue")
+    parser.add_argument("--jobs", type = int, default = 1, help = "worker processes used to generate or solve levels, 0 for one per core")
+    parser.add_argument("--ahead", type = int, default = 2, help = "levels to generate in the background ahead of the one being played")
+    parser.add_argument("--mode", choices = ("walk", "pull"), default = "walk", help = "level generator: random box walks checked by the solver, or reverse play")
+    parser.add_argument("--pack", help = "play the levels of an XSB pack instead of generating them")
+    parser.add_argument("--export", metavar = "PATH", help = "generate a session's levels into an XSB pack and exit")
+    parser.add_argument("--solve", metavar = "PACK", help = "solve every level of an XSB pack with --jobs processes and exit")
+    parser.add_argument("--max-nodes", type = int, default = 50000, help = "positions --solve searches per level before giving up")
+    parser.add_argument("--levels", type = int, help = "how many levels --export generates, asked for if not given")
+    parser.add_argument("--seed", type = int, help = "seed for the session, the same seed always gives the same levels")
+    parser.add_argument("--cache", metavar = "DIR", help = "keep generated levels in DIR and reuse them instead of generating again")
+    parser.add_argument("--cache-size", type = int, default = 64, help = "megabytes the level cache may use before old levels are dropped")
+    parser.add_argument("--log", metavar = "LEVEL", choices = ("DEBUG", "INFO", "WARNING", "ERROR"), help = "turn logging on at LEVEL, it's off by default")
+    parser.add_argument("--log-file", metavar = "PATH", help = "where --log writes to, stderr if not given")
+    args = parser.parse_args()
+    if(args.log):
+        configure(args.log, args.log_file)
+    cache = LevelCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    if(args.export):
+        levelcount = args.levels or int(input("Please enter the total number of levels."))
+        print("Wrote " + str(export_pack(args.export, levelcount, args.jobs or None, args.mode, args.seed, cache)) + " levels to " + args.export)
+    elif(args.solve):
+        for number, result in solve_pack(args.solve, args.jobs or None, args.max_nodes):
+            print("Level " + str(number + 1) + ": " + result.status + ("" if result.pushes is None else " in " + str(len(result.pushes)) + " pushes") + ", " + str(result.nodes) + " positions searched")
+    else:
+        main(args.jobs, args.ahead, args.mode, args.pack, args.seed, cache)
@@ -0,0 +1,99 @@
+'''
+Logging and timing for Sokoblue, built on the standard logging module.
+
+Everything goes through the "sokoblue" logger, which is off by default:
+until configure() is called, log calls cost one level check and messages
+are never formatted. Pass arguments to the logger instead of building
+strings, so that stays true:
+
+    log.debug("boxes remaining: %d", remaining)
+
+span() times a block and logs how long it took at DEBUG.
+'''
+import collections
+import logging
+import time
+from contextlib import contextmanager
+
+Format = "%(asctime)s %(processName)s %(levelname)s %(message)s"
+
+log = logging.getLogger("sokoblue")
+log.addHandler(logging.NullHandler())
+log.propagate = False
+log.setLevel(logging.CRITICAL + 1) #Off
+
+
+class RingHandler(logging.Handler):
+    '''
+    Keeps the last capacity formatted records in memory, so a long session
+    can be logged in full detail and only looked at when something goes wrong.
+    '''
+
+    def __init__(self, capacity = 10000):
+        logging.Handler.__init__(self)
+        self.records = collections.deque(maxlen = capacity)
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+    def lines(self):
+        return list(self.records)
+
+    def dump(self, path):
+        '''
+        Params: path (String)
+        Outputs: None
+        Writes the buffered records to a file, oldest first.
+        '''
+        with open(path, "w") as out:
+            for line in self.records:
+                out.write(line + "\n")
+
+
+def configure(level = "DEBUG", path = None, ring = None):
+    '''
+    Params: level, path, ring (String or int, String, int)
+    Outputs: RingHandler or None
+    Turns logging on at level. Records go to the file at path, or to a ring
+    buffer of ring records (returned so it can be read or dumped), or to
+    stderr if neither is given.
+    '''
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+    if(ring):
+        handler = RingHandler(ring)
+    elif(path):
+        handler = logging.FileHandler(path)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(Format))
+    log.addHandler(handler)
+    log.setLevel(level)
+    return handler if ring else None
+
+
+def disable():
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.CRITICAL + 1)
+
+
+@contextmanager
+def span(name, *args):
+    '''
+    Params: name, args (String, values for name's % placeholders)
+    Outputs: None
+    Times the block it wraps and logs the result at DEBUG. Costs a single
+    level check when DEBUG is off.
+    '''
+    if(not log.isEnabledFor(logging.DEBUG)):
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        log.debug(name + " took %.3f ms", *(args + ((time.perf_counter() - start) * 1000,)))
@@ -0,0 +1,144 @@
+'''
+Wall layouts for RandomGameMap, built as flat arrays instead of Tile objects.
+
+A layout is a bytes object with one byte per cell, row by row: Floor or
+Wall. Layouts can be drawn in batches. A batch of more than one is drawn
+with NumPy if it's installed: the whole batch is one int8 array, and the
+border and every wall line in the batch are drawn with a few array
+operations. Otherwise, and always for a single layout, the lines are drawn
+cell by cell in Python. NumPy is only imported for the first batch, so
+importing this module (and core) doesn't pay for it.
+
+Lines step the way the Tile generator always has, and NumPy and Python
+draw the same cells, so a seed gives the same layout either way.
+'''
+Floor = 0
+Wall = 1
+BitTable = bytes.maketrans(b"\x00\x01", b"01")
+numpy = None #The numpy module once load_numpy has looked for it, False if it isn't installed
+
+
+def load_numpy():
+    '''
+    Params: None
+    Outputs: module or None
+    NumPy, imported the first time it's asked for. None if it isn't installed.
+    '''
+    global numpy
+    if(numpy is None):
+        try:
+            import numpy as np
+            numpy = np
+        except ImportError:
+            numpy = False
+    return numpy or None
+
+
+def wall_lines(rng, height, width, wallcount):
+    '''
+    Params: rng, height, width, wallcount (Random, int, int, int)
+    Outputs: list of (row1, col1, row2, col2)
+    Random end points for a layout's wall lines. The two ends of a line always differ.
+    '''
+    lines = []
+    for wall in range(wallcount):
+        while(True):
+            col1 = rng.randint(1, width - 1)
+            row1 = rng.randint(1, height - 1)
+            col2 = rng.randint(1, width - 1)
+            row2 = rng.randint(1, height - 1)
+            if((row1, col1) != (row2, col2)):
+                break
+        lines.append((row1, col1, row2, col2))
+    return lines
+
+
+def line_cells(row1, col1, row2, col2):
+    '''
+    Params: row1, col1, row2, col2 (int, int, int, int)
+    Outputs: list of (row, col)
+    The cells of a line, not counting the start: one per unit of its
+    Manhattan length, found by adding a float step and rounding half to
+    even, exactly as draw_batch does.
+    '''
+    steps = abs(row2 - row1) + abs(col2 - col1)
+    drow = (row2 - row1) / steps
+    dcol = (col2 - col1) / steps
+    row = row1
+    col = col1
+    cells = []
+    for step in range(steps):
+        row += drow
+        col += dcol
+        cells.append((int(round(row)), int(round(col))))
+    return cells
+
+
+def draw_batch(np, batch, height, width):
+    '''
+    Params: np, batch, height, width (module, list of line lists, int, int)
+    Outputs: list of bytes
+    Rasterises every layout's border and wall lines in one go with NumPy.
+    '''
+    count = len(batch)
+    grid = np.zeros((count, height, width), dtype = np.int8)
+    grid[:, 0, :] = Wall
+    grid[:, -1, :] = Wall
+    grid[:, :, 0] = Wall
+    grid[:, :, -1] = Wall
+    lines = np.array([line for lines in batch for line in lines], dtype = np.int64).reshape(-1, 4)
+    if(len(lines)):
+        owner = np.repeat(np.arange(count), len(lines) // count)
+        row1, col1, row2, col2 = lines.T
+        steps = np.abs(row2 - row1) + np.abs(col2 - col1)
+        span = steps.max() + 1
+        #cumsum adds the steps one at a time, the same float sums as line_cells
+        rows = np.repeat(((row2 - row1) / steps)[:, None], span, axis = 1)
+        cols = np.repeat(((col2 - col1) / steps)[:, None], span, axis = 1)
+        rows[:, 0] = row1
+        cols[:, 0] = col1
+        rows = np.rint(np.cumsum(rows, axis = 1)).astype(np.int64)
+        cols = np.rint(np.cumsum(cols, axis = 1)).astype(np.int64)
+        t = np.arange(span)[None, :]
+        inside = (t >= 1) & (t <= steps[:, None])
+        grid[np.broadcast_to(owner[:, None], inside.shape)[inside], rows[inside], cols[inside]] = Wall
+    return [layout.tobytes() for layout in grid]
+
+
+def draw_python(lines, height, width):
+    '''
+    Params: lines, height, width (list, int, int)
+    Outputs: bytes
+    The same as one layout of draw_batch, without NumPy.
+    '''
+    layout = bytearray(height * width)
+    for row in range(height):
+        for col in range(width):
+            if(row == 0 or col == 0 or row == height - 1 or col == width - 1):
+                layout[row * width + col] = Wall
+    for line in lines:
+        for row, col in line_cells(*line):
+            layout[row * width + col] = Wall
+    return bytes(layout)
+
+
+def layouts(rng, count, height, width, wallcount):
+    '''
+    Params: rng, count, height, width, wallcount (Random, int, int, int, int)
+    Outputs: list of bytes
+    count candidate layouts, each a height x width border with wallcount random wall lines.
+    '''
+    batch = [wall_lines(rng, height, width, wallcount) for layout in range(count)]
+    np = load_numpy() if count > 1 else None
+    if(np is not None):
+        return draw_batch(np, batch, height, width)
+    return [draw_python(lines, height, width) for lines in batch]
+
+
+def wall_bits(layout):
+    '''
+    Params: layout (bytes)
+    Outputs: int
+    The layout's walls as a Board bitmap, converted in C rather than cell by cell.
+    '''
+    return int(layout[::-1].translate(BitTable), 2)
@@ -0,0 +1,100 @@
+'''
+On-disk cache of generated levels.
+
+A generated level is fully determined by its seed and generator settings,
+so the cache is content addressed: each level is stored in a file named
+after a hash of (generator version, seed, h, w, boxes, walls, difficulty,
+mode, layout batch). Reading a level touches its file, and once the
+directory grows past max_bytes the least recently used files are deleted
+first.
+'''
+import hashlib
+import os
+import pickle
+
+Suffix = ".level"
+
+
+class LevelCache():
+    '''
+    A directory of cached levels, stored as pickled (key, State) pairs.
+    Only holds a path and a size, so it can be handed to worker processes.
+    '''
+
+    def __init__(self, directory, max_bytes = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, key):
+        '''
+        Params: key (tuple)
+        Outputs: String
+        The file a level with this key lives in.
+        '''
+        digest = hashlib.sha1(repr(key).encode("ascii")).hexdigest()
+        return os.path.join(self.directory, digest + Suffix)
+
+    def get(self, key):
+        '''
+        Params: key (tuple)
+        Outputs: State or None
+        Returns the cached level for key, or None if it isn't cached.
+        '''
+        path = self.path(key)
+        try:
+            with open(path, "rb") as level:
+                stored, state = pickle.load(level)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if(stored != key):
+            return None
+        #Mark it as recently used
+        os.utime(path)
+        return state
+
+    def put(self, key, state):
+        '''
+        Params: key, state (tuple, State)
+        Outputs: None
+        Stores a level, then evicts old ones if the cache is over size.
+        '''
+        path = self.path(key)
+        #Write under another name first, so other processes never read half a file
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, "wb") as level:
+            pickle.dump((key, state), level, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+        self.evict()
+
+    def evict(self):
+        '''
+        Params: None
+        Outputs: None
+        Deletes least recently used levels until the cache fits in max_bytes.
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if(not name.endswith(Suffix)):
+                continue
+            try:
+                info = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, name))
+            total += info.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if(total <= self.max_bytes):
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if(name.endswith(Suffix)):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,250 @@
+'''
+Level packs in the standard XSB text format.
+
+A pack is a plain .xsb file that other Sokoban programs can read: every
+level starts with a "; <number>" comment line and ends with a blank line.
+Packs from elsewhere often carry titles, authors and other notes as well;
+those lines are told apart from level rows and skipped, see is_board_row.
+Next to it sits an index file (pack path + ".idx") holding the byte offset
+of every level as little-endian 64-bit integers, then the pack's length,
+so LevelPack can find level N with one lookup into a memory-mapped file
+instead of parsing everything before it. An index that doesn't end at the
+pack's length, or is older than the pack, is out of date and gets rebuilt.
+'''
+import mmap
+import os
+import struct
+from state import Board, State
+
+Wall = "#"
+Floor = " "
+Goal = "."
+Box = "$"
+BoxOnGoal = "*"
+Player = "@"
+PlayerOnGoal = "+"
+BoardGlyphs = frozenset("#@+$*. -_") #"-" and "_" are floor too, for packs that avoid spaces
+
+OffsetFormat = "<Q"
+OffsetSize = struct.calcsize(OffsetFormat)
+
+
+def to_xsb(state):
+    '''
+    Params: state (State)
+    Outputs: String
+    Writes a compact State out as XSB rows, one line per row.
+    '''
+    board = state.board
+    lines = []
+    for row in range(board.height):
+        line = []
+        for col in range(board.width):
+            index = board.index(row, col)
+            goal = (board.goals >> index) & 1
+            if((board.walls >> index) & 1):
+                line.append(Wall)
+            elif(state.has_box(index)):
+                line.append(BoxOnGoal if goal else Box)
+            elif(index == state.player):
+                line.append(PlayerOnGoal if goal else Player)
+            else:
+                line.append(Goal if goal else Floor)
+        lines.append("".join(line).rstrip())
+    return "\n".join(lines)
+
+
+def is_board_row(line):
+    '''
+    Params: line (String)
+    Outputs: True or False
+    Level rows hold at least one wall and nothing but level glyphs. Comments,
+    titles ("Title: ...") and other metadata lines never pass.
+    '''
+    line = line.rstrip("\r\n")
+    return Wall in line and set(line) <= BoardGlyphs
+
+
+def from_xsb(text):
+    '''
+    Params: text (String)
+    Outputs: State
+    Reads a single XSB level: the first run of level rows in text, so comments
+    and metadata around it are skipped. Ragged rows are padded. Floor the
+    player can't walk to is outside the level, so it's turned into wall
+    (see State.normalised).
+    '''
+    rows = []
+    for line in text.split("\n"):
+        if(is_board_row(line)):
+            rows.append(line.rstrip("\r"))
+        elif(rows):
+            break
+    if(not rows):
+        raise ValueError("no level in text")
+    height = len(rows)
+    width = max(len(line) for line in rows)
+    walls = 0
+    goals = 0
+    boxes = 0
+    player = None
+    for row, line in enumerate(rows):
+        for col, glyph in enumerate(line.ljust(width)):
+            bit = 1 << (row * width + col)
+            if(glyph == Wall):
+                walls |= bit
+            if(glyph in (Goal, BoxOnGoal, PlayerOnGoal)):
+                goals |= bit
+            if(glyph in (Box, BoxOnGoal)):
+                boxes |= bit
+            if(glyph in (Player, PlayerOnGoal)):
+                player = row * width + col
+    if(player is None):
+        raise ValueError("level has no player")
+    return State(Board(height, width, walls, goals), boxes, player).normalised()
+
+
+def write_pack(path, states, unique = False):
+    '''
+    Params: path, states, unique (String, iterable of State, bool)
+    Outputs: count (int)
+    Writes a pack and its index, returning how many levels went in.
+    If unique is set, levels with the same canonical hash as an earlier one are dropped.
+    '''
+    offsets = []
+    seen = set()
+    with open(path, "wb") as pack:
+        for state in states:
+            if(unique):
+                level_hash = state.canonical_hash()
+                if(level_hash in seen):
+                    continue
+                seen.add(level_hash)
+            offsets.append(pack.tell())
+            pack.write(("; %d\n%s\n\n" % (len(offsets), to_xsb(state))).encode("ascii"))
+        offsets.append(pack.tell())
+    write_index(path, offsets)
+    return len(offsets) - 1
+
+
+def write_index(path, offsets):
+    '''
+    Params: path, offsets (String, list)
+    Outputs: None
+    Writes the offset index for the pack at path. offsets ends with the file's length.
+    '''
+    with open(path + ".idx", "wb") as index:
+        index.write(struct.pack("<%dQ" % len(offsets), *offsets))
+
+
+def build_index(path):
+    '''
+    Params: path (String)
+    Outputs: None
+    Scans a pack that has no index yet (one from elsewhere, say) and writes one.
+    Levels are runs of non-blank lines, runs without any level rows (headers,
+    comments, notes between levels) are skipped.
+    '''
+    offsets = []
+    position = 0
+    start = None
+    has_level = False
+    with open(path, "rb") as pack:
+        for line in pack:
+            if(line.strip()):
+                if(start is None):
+                    start = position
+                    has_level = False
+                if(is_board_row(line.decode("latin-1"))):
+                    has_level = True
+            elif(start is not None):
+                if(has_level):
+                    offsets.append(start)
+                start = None
+            position += len(line)
+    if(start is not None and has_level):
+        offsets.append(start)
+    write_index(path, offsets + [position])
+
+
+def index_is_current(path):
+    '''
+    Params: path (String)
+    Outputs: bool
+    Whether the pack at path has an index that still matches it: one written
+    no earlier than the pack, whose last offset is the pack's length.
+    '''
+    index_path = path + ".idx"
+    if(not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path)):
+        return False
+    size = os.path.getsize(index_path)
+    if(size < OffsetSize or size % OffsetSize):
+        return False
+    with open(index_path, "rb") as index:
+        index.seek(size - OffsetSize)
+        return struct.unpack(OffsetFormat, index.read(OffsetSize))[0] == os.path.getsize(path)
+
+
+def map_file(file):
+    '''
+    Params: file (file)
+    Outputs: mmap or bytes
+    A read-only map of an open file. mmap can't map an empty file, so that gives empty bytes.
+    '''
+    if(os.fstat(file.fileno()).st_size == 0):
+        return b""
+    return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+class LevelPack():
+    '''
+    Random access to the levels in a pack. Both the pack and its index are
+    memory-mapped, so opening a pack and loading any one level costs the
+    same however many levels it holds.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if(not index_is_current(path)):
+            build_index(path)
+        self.pack_file = open(path, "rb")
+        self.index_file = open(path + ".idx", "rb")
+        self.pack = map_file(self.pack_file)
+        self.index = map_file(self.index_file)
+        self.count = len(self.index) // OffsetSize - 1
+
+    def __len__(self):
+        return self.count
+
+    def text(self, number):
+        '''
+        Params: number (int)
+        Outputs: String
+        The raw XSB text of level number, counting from 0.
+        '''
+        if(number < 0):
+            number += self.count
+        if(not 0 <= number < self.count):
+            raise IndexError("pack has %d levels" % self.count)
+        start, end = struct.unpack_from("<QQ", self.index, number * OffsetSize)
+        return self.pack[start:end].decode("utf-8", "replace")
+
+    def __getitem__(self, number):
+        return from_xsb(self.text(number))
+
+    def __iter__(self):
+        for number in range(self.count):
+            yield self[number]
+
+    def close(self):
+        for mapped in (self.pack, self.index):
+            if(isinstance(mapped, mmap.mmap)):
+                mapped.close()
+        self.pack_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
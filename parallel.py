@@ -0,0 +1,242 @@
+'''
+Parallel version of the solver, for maps too big to search on one core.
+
+Every position is owned by one worker process, picked by hashing its boxes,
+and each worker keeps the transposition table and open list for only the
+positions it owns. The search runs in rounds: each worker expands its own
+best batch of positions and hands back the pushes it found, grouped by
+owner, and the coordinator passes those batches on at the start of the next
+round. Because every round ends with all workers idle, running out of
+positions everywhere is a proof the map can't be solved.
+
+Workers don't wait for each other's best positions (as in HDA*), so they go
+through positions in a different order from the sequential Solver and some
+of the work is wasted. window limits that: a round only expands positions
+whose f is within window of the best f queued anywhere at the start of it.
+
+Batches are small because a round trip to every worker costs a fraction of
+expanding one position, while each position in a batch is one more a
+worker may expand before it sees the children the others sent it.
+'''
+import heapq
+import multiprocessing
+from solver import Solver, SolverResult, SOLVED, UNSOLVABLE, GAVE_UP, Matching, entry_bytes
+from closedset import Start
+from state import State
+
+
+Mix = 0x9E3779B97F4A7C15 #Odd 64 bit multiplier (2**64 / golden ratio)
+
+
+def owner(boxes, jobs):
+    '''
+    Params: boxes, jobs (int, int)
+    Outputs: int
+    The worker a position belongs to. An int's hash is its value mod 2**61 - 1,
+    so its low bits only depend on a few cells, and most boards would land on
+    a handful of workers. Multiplying spreads every bit of it into the top
+    bits, which pick the worker. Unlike str hashes, int ones are the same in every process.
+    '''
+    return ((hash(boxes) * Mix) & 0xFFFFFFFFFFFFFFFF) * jobs >> 64
+
+
+class Partition():
+    '''
+    One worker's share of the search: the positions whose boxes hash to number.
+    '''
+
+    def __init__(self, state, number, jobs, weight, max_bytes, spill):
+        self.solver = Solver(state, weight = weight, max_bytes = max_bytes, spill = spill)
+        self.table = self.solver.start().table
+        self.number = number
+        self.jobs = jobs
+        self.closed = None #This worker's part of the transposition table, made on the first expand
+        self.open = []
+        self.queued = 0 #Memory held by open
+        self.counter = 0
+
+    def receive(self, batch):
+        '''
+        Params: batch (list)
+        Outputs: None
+        Queues positions sent by other workers, as (f, g, boxes, player, packed matching, pushed box, direction).
+        '''
+        for entry in batch:
+            self.queue(*entry)
+
+    def queue(self, f, g, boxes, player, packed, box, direction):
+        self.counter += 1
+        self.queued += entry_bytes(boxes, packed)
+        heapq.heappush(self.open, (f, g, self.counter, boxes, player, packed, box, direction))
+
+    def best(self):
+        return self.open[0][:2] if self.open else None
+
+    def expand(self, limit, bound):
+        '''
+        Params: limit, bound (int, int)
+        Outputs: outgoing, solved, nodes, best (list, tuple, int, tuple)
+        Expands up to limit positions, best first, stopping at any with f above
+        bound (None for no bound). New positions this worker owns are queued
+        straight away, outgoing holds a batch of the others for each worker.
+        solved is the (boxes, player) of a solved position if one turned up,
+        and best is the rank of the best position still queued here, None if
+        there are none. Ranks are (f, g) pairs, the order Solver takes positions in.
+        '''
+        solver = self.solver
+        outgoing = [[] for job in range(self.jobs)]
+        nodes = 0
+        if(self.closed is None):
+            self.closed = solver.closed_set()
+        while(self.open and nodes < limit and (bound is None or self.open[0][0] <= bound)):
+            f, g, _, boxes, player, packed, pushed, direction = heapq.heappop(self.open)
+            self.queued -= entry_bytes(boxes, packed)
+            seen = solver.reachable(player, boxes)
+            player = seen.index(1)
+            if(not self.closed.add(boxes, player, pushed, direction)):
+                continue
+            if(not (solver.goals & ~boxes)):
+                return outgoing, (boxes, player), nodes, self.best()
+            nodes += 1
+            matching = Matching.unpack(self.table, packed)
+            for moved, box, d, after in solver.successors(boxes, seen, matching):
+                child = (g + 1 + solver.weight * after.total, g + 1, moved, box, after.pack(), box, solver.directions[d])
+                target = owner(moved, self.jobs)
+                if(target == self.number):
+                    self.queue(*child)
+                else:
+                    outgoing[target].append(child)
+            solver.check_memory(self.closed, self.queued)
+        return outgoing, None, nodes, self.best()
+
+
+def work(state, number, jobs, weight, max_bytes, spill, conn):
+    '''
+    Params: state, number, jobs, weight, max_bytes, spill (State, int, int, int, int, String, Connection)
+    Outputs: None
+    Worker process loop. Answers the coordinator's requests until told to stop.
+    Running out of memory is passed back as None.
+    '''
+    partition = Partition(state, number, jobs, weight, max_bytes, spill)
+    while(True):
+        command, arg = conn.recv()
+        if(command == "expand"):
+            batch, limit, bound = arg
+            partition.receive(batch)
+            try:
+                conn.send(partition.expand(limit, bound))
+            except MemoryError:
+                conn.send(None)
+        elif(command == "push"):
+            conn.send(partition.closed.push(*arg))
+        else:
+            break
+    if(partition.closed is not None):
+        partition.closed.close()
+    conn.close()
+
+
+class ParallelSolver():
+    '''
+    Runs the same search as Solver across jobs worker processes (one per core if None).
+    Each round every worker expands up to batch of its own best positions,
+    leaving any with f more than window above the best queued anywhere
+    (None for no limit). max_bytes and spill apply to each worker's share
+    of the transposition table. After solve, critical is the nodes the
+    busiest worker expanded each round, added up: with a core per worker
+    it's that, not the total, which the wall time follows.
+    '''
+
+    def __init__(self, game_map, jobs = None, max_nodes = 50000, weight = 2, batch = 2, window = None, max_bytes = None, spill = None):
+        self.start = game_map if isinstance(game_map, State) else State.from_map(game_map)
+        self.solver = Solver(self.start)
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.max_nodes = max_nodes
+        self.weight = weight
+        self.batch = batch
+        self.window = window
+        self.critical = 0 #Nodes expanded by the busiest worker each round, summed: the search's length with a core per worker
+
+    def solve(self):
+        '''
+        Params: None
+        Outputs: SolverResult
+        Runs rounds until some worker reaches a solved position, every
+        worker runs out of positions, or the node budget is spent.
+        '''
+        matching = self.solver.start()
+        if(matching is None):
+            return SolverResult(UNSOLVABLE, None, 0)
+        conns = []
+        workers = []
+        for number in range(self.jobs):
+            mine, theirs = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target = work, args = (self.start, number, self.jobs, self.weight, self.max_bytes, self.spill, theirs), daemon = True)
+            worker.start()
+            theirs.close()
+            conns.append(mine)
+            workers.append(worker)
+        try:
+            return self.search(conns, matching)
+        finally:
+            for conn in conns:
+                conn.send(("stop", None))
+                conn.close()
+            for worker in workers:
+                worker.join()
+
+    def search(self, conns, matching):
+        inboxes = [[] for job in range(self.jobs)]
+        inboxes[owner(self.start.boxes, self.jobs)].append((0, 0, self.start.boxes, self.start.player, matching.pack(), Start, 0))
+        bound = None #Highest f a worker may expand this round
+        nodes = 0
+        self.critical = 0
+        while(True):
+            for conn, inbox in zip(conns, inboxes):
+                conn.send(("expand", (inbox, self.batch, bound)))
+            inboxes = [[] for job in range(self.jobs)]
+            solved = None
+            ranks = []
+            replies = [conn.recv() for conn in conns]
+            if(None in replies):
+                return SolverResult(GAVE_UP, None, nodes)
+            self.critical += max(reply[2] for reply in replies)
+            for outgoing, found, expanded, best in replies:
+                nodes += expanded
+                solved = solved or found
+                if(best is not None):
+                    ranks.append(best)
+                for job, batch in enumerate(outgoing):
+                    inboxes[job].extend(batch)
+                    ranks.extend(child[:2] for child in batch)
+            if(solved is not None):
+                return SolverResult(SOLVED, self.rebuild(conns, solved), nodes)
+            if(not ranks):
+                return SolverResult(UNSOLVABLE, None, nodes)
+            if(self.window is not None):
+                bound = min(ranks)[0] + self.window
+            if(nodes > self.max_nodes):
+                return SolverResult(GAVE_UP, None, nodes)
+
+    def rebuild(self, conns, position):
+        '''
+        Params: conns, position (list, tuple)
+        Outputs: pushes (list)
+        Walks back from a solved position, asking each position's owner which push reached it.
+        '''
+        def lookup(boxes, player):
+            conn = conns[owner(boxes, self.jobs)]
+            conn.send(("push", (boxes, player)))
+            return conn.recv()
+        return self.solver.rebuild(lookup, *position)
+
+
+def solve(game_map, jobs = None, max_nodes = 50000):
+    '''
+    Params: game_map, jobs, max_nodes (GameMap or State, int, int)
+    Outputs: SolverResult
+    Convenience wrapper around ParallelSolver.
+    '''
+    return ParallelSolver(game_map, jobs, max_nodes).solve()
@@ -0,0 +1,506 @@
+'''
+Sokoban solver. Used by RandomGameMap to check that a generated map
+can actually be completed, instead of asking a human.
+'''
+import heapq
+import sys
+from array import array
+from state import State, bit_cells, reachable
+from closedset import ClosedSet, Start
+
+SOLVED = "solved"
+UNSOLVABLE = "unsolvable"
+GAVE_UP = "gave up"
+
+Unreachable = 1 << 20 #Push distance of a goal a box can never reach, big enough to dwarf any real total
+EntryBytes = 240 #An open list entry's tuple, small ints and heap slot, on top of its boxes and packed Matching
+
+
+def push_distances(board, walls = None):
+    '''
+    Params: board, walls (Board, bytearray)
+    Outputs: table (list)
+    For each goal, lowest goal index first, the fewest pushes that get a box
+    from every cell onto it, ignoring other boxes and where the player is.
+    Worked out by pulling a box backwards out of each goal: a box can be
+    pushed from cell to cell + d only if the player fits on cell - d.
+    Cells the box can't get to the goal from are Unreachable.
+    '''
+    if(walls is None):
+        walls = board.wall_array()
+    deltas = board.deltas()
+    table = []
+    for goal in bit_cells(board.goals):
+        distance = [Unreachable] * len(walls)
+        distance[goal] = 0
+        queue = [goal]
+        for cell in queue:
+            for d in deltas:
+                prev = cell - d
+                if(0 <= prev - d < len(walls) and distance[prev] == Unreachable and not walls[prev] and not walls[prev - d]):
+                    distance[prev] = distance[cell] + 1
+                    queue.append(prev)
+        table.append(distance)
+    return table
+
+
+class Matching():
+    '''
+    Minimum-cost assignment of boxes to goals, where a box costs its push
+    distance to the goal it gets. Every box needs at least that many pushes,
+    so total is a lower bound on the pushes left, and it's Unreachable or more
+    when the boxes can't all be got home at once.
+
+    Solved with the Hungarian method, keeping the dual potentials (u for
+    goals, v for boxes) so that after one box moves only its goal has to be
+    found again, with a single augmenting path, rather than starting over.
+    Extra boxes are matched to zero-cost dummy goals so the problem stays square.
+    '''
+    __slots__ = ("table", "cells", "u", "v", "owner", "total")
+
+    def __init__(self, table, cells):
+        self.table = table + [None] * (len(cells) - len(table)) #None rows are dummy goals
+        self.cells = list(cells)
+        size = len(self.cells)
+        self.u = [0] * size
+        self.v = [0] * size
+        self.owner = [-1] * size #owner[box] is the goal matched to it
+        for goal in range(size):
+            self.augment(goal)
+        self.update_total()
+
+    def cost(self, goal, box):
+        row = self.table[goal]
+        return 0 if row is None else row[self.cells[box]]
+
+    def augment(self, start):
+        '''
+        Params: start (int)
+        Outputs: None
+        Finds the cheapest way to give the unmatched goal start a box, shifting
+        other goals along a shortest augmenting path and adjusting the potentials.
+        '''
+        size = len(self.cells)
+        u = self.u
+        v = self.v
+        owner = self.owner
+        table = self.table
+        cells = self.cells
+        slack = [None] * size
+        via = [-1] * size #The box each box's slack was found through, -1 for start
+        used = [False] * size
+        goal = start
+        last = -1
+        while(True):
+            row = table[goal]
+            base = u[goal]
+            delta = None
+            nxt = -1
+            for box in range(size):
+                if(used[box]):
+                    continue
+                reduced = (0 if row is None else row[cells[box]]) - base - v[box]
+                if(slack[box] is None or reduced < slack[box]):
+                    slack[box] = reduced
+                    via[box] = last
+                if(delta is None or slack[box] < delta):
+                    delta = slack[box]
+                    nxt = box
+            u[start] += delta
+            for box in range(size):
+                if(used[box]):
+                    u[owner[box]] += delta
+                    v[box] -= delta
+                else:
+                    slack[box] -= delta
+            used[nxt] = True
+            last = nxt
+            if(owner[nxt] == -1):
+                break
+            goal = owner[nxt]
+        #Flip the path back to start
+        box = last
+        while(box != -1):
+            prev = via[box]
+            owner[box] = start if prev == -1 else owner[prev]
+            box = prev
+
+    def pack(self):
+        '''
+        Params: None
+        Outputs: bytes
+        Everything but the table, in a quarter of the memory the lists take.
+        Potentials and total as 32 bit ints, then cells and owner as 16 bit ones.
+        '''
+        return array("i", self.u + self.v + [self.total]).tobytes() + array("H", self.cells + self.owner).tobytes()
+
+    @classmethod
+    def unpack(cls, table, packed):
+        '''
+        Params: table, packed (list, bytes)
+        Outputs: Matching
+        Rebuilds a packed Matching. table is an existing Matching's table for the same board.
+        '''
+        size = (len(packed) - 4) // 12
+        split = 4 * (2 * size + 1)
+        ints = array("i")
+        ints.frombytes(packed[:split])
+        shorts = array("H")
+        shorts.frombytes(packed[split:])
+        matching = cls.__new__(cls)
+        matching.table = table
+        matching.u = ints[:size].tolist()
+        matching.v = ints[size:2 * size].tolist()
+        matching.total = ints[-1]
+        matching.cells = shorts[:size].tolist()
+        matching.owner = shorts[size:].tolist()
+        return matching
+
+    def update_total(self):
+        self.total = sum(self.cost(self.owner[box], box) for box in range(len(self.cells)))
+
+    def moved(self, old, new):
+        '''
+        Params: old, new (int, int)
+        Outputs: Matching
+        A copy with the box on cell old moved to cell new. Only that box's
+        column of costs changes, so it's dropped from its goal, its potential
+        is lowered until every goal is feasible again, and that one goal is
+        rematched.
+        '''
+        other = Matching.__new__(Matching)
+        other.table = self.table
+        other.cells = list(self.cells)
+        other.u = list(self.u)
+        other.v = list(self.v)
+        other.owner = list(self.owner)
+        box = other.cells.index(old)
+        other.cells[box] = new
+        goal = other.owner[box]
+        other.owner[box] = -1
+        other.v[box] = min(other.cost(row, box) - other.u[row] for row in range(len(other.cells)))
+        other.augment(goal)
+        other.update_total()
+        return other
+
+
+class SolverResult():
+    '''
+    The outcome of a search.
+    status is one of SOLVED, UNSOLVABLE or GAVE_UP (node budget ran out).
+    pushes is a list of (cell, delta) pairs when solved, where cell is the
+    flat index of the pushed box and delta the flat offset it was pushed by.
+    '''
+
+    def __init__(self, status, pushes, nodes):
+        self.status = status
+        self.pushes = pushes
+        self.nodes = nodes
+
+    def __bool__(self):
+        return self.status == SOLVED
+
+    def __repr__(self):
+        return "SolverResult(%s, pushes=%s, nodes=%d)" % (self.status, None if self.pushes is None else len(self.pushes), self.nodes)
+
+
+class Deadlocks():
+    '''
+    Static deadlock tables for a board, shared by the generator and the solver.
+    dead marks every floor cell a box can never be pushed from onto any goal,
+    worked out once by pulling boxes backwards out of every goal. Goals can be
+    added and taken away again afterwards, see add_goal.
+    '''
+
+    def __init__(self, board):
+        self.board = board
+        self.width = board.width
+        self.goals = board.goals
+        self.walls = board.wall_array()
+        self.live = bytearray(len(self.walls)) #Cells a box can still reach a goal from
+        self.dead = self.dead_squares()
+
+    def dead_squares(self):
+        '''
+        Params: None
+        Outputs: dead (bytearray)
+        A box can be pushed from cell to cell + d only if the player fits on
+        cell - d. Walking that rule backwards from the goals finds every cell a
+        box can still be solved from, everything else that isn't wall is dead.
+        '''
+        walls = self.walls
+        live = self.live
+        self.spread(bit_cells(self.goals))
+        dead = bytearray(len(walls))
+        for cell in range(len(walls)):
+            if(not walls[cell] and not live[cell]):
+                dead[cell] = 1
+        return dead
+
+    def spread(self, goals):
+        '''
+        Params: goals (list)
+        Outputs: revived (list)
+        Marks goals live, along with every cell a box can be pushed onto them
+        from. Returns the cells that weren't live before.
+        '''
+        walls = self.walls
+        live = self.live
+        queue = [goal for goal in goals if not live[goal]]
+        for goal in queue:
+            live[goal] = 1
+        for cell in queue:
+            for d in self.board.deltas():
+                prev = cell - d
+                if(0 <= prev - d < len(walls) and not live[prev] and not walls[prev] and not walls[prev - d]):
+                    live[prev] = 1
+                    queue.append(prev)
+        return queue
+
+    def add_goal(self, cell):
+        '''
+        Params: cell (int)
+        Outputs: revived (list)
+        Makes cell a goal without rebuilding the tables, for placing goals one at
+        a time. Returns the cells it brought back to life, for remove_goal.
+        '''
+        self.goals |= 1 << cell
+        revived = self.spread([cell])
+        for square in revived:
+            self.dead[square] = 0
+        return revived
+
+    def remove_goal(self, cell, revived):
+        '''
+        Params: cell, revived (int, list)
+        Outputs: None
+        Undoes the last add_goal(cell), which returned revived.
+        '''
+        self.goals &= ~(1 << cell)
+        for square in revived:
+            self.live[square] = 0
+            self.dead[square] = 1
+
+    def frozen(self, boxes, cell, checked = None):
+        '''
+        Params: boxes, cell, checked (int, int, set)
+        Outputs: True or False
+        A box is frozen when it can move along neither axis, because of walls,
+        dead squares on both sides, or other frozen boxes. Boxes already being
+        looked at count as walls, which keeps the recursion finite.
+        '''
+        if(checked is None):
+            checked = set()
+        checked.add(cell)
+        return self.axis_blocked(boxes, cell, self.width, checked) and self.axis_blocked(boxes, cell, 1, checked)
+
+    def axis_blocked(self, boxes, cell, d, checked):
+        before = cell - d
+        after = cell + d
+        if(self.walls[before] or self.walls[after]):
+            return True
+        if(self.dead[before] and self.dead[after]):
+            return True
+        for side in (before, after):
+            if(side in checked):
+                return True
+            if((boxes >> side) & 1 and self.frozen(boxes, side, checked)):
+                return True
+        return False
+
+    def deadlocked(self, boxes, cell):
+        '''
+        Params: boxes, cell (int, int)
+        Outputs: True or False
+        True if the box on cell is on a dead square, or frozen somewhere other than a goal.
+        '''
+        if(self.dead[cell]):
+            return True
+        return not (self.goals >> cell) & 1 and self.frozen(boxes, cell)
+
+
+def entry_bytes(boxes, packed):
+    '''
+    Params: boxes, packed (int, bytes)
+    Outputs: int
+    Roughly what one open list entry costs, for keeping to max_bytes.
+    '''
+    return EntryBytes + sys.getsizeof(boxes) + sys.getsizeof(packed)
+
+
+class Solver():
+    '''
+    Best-first search over box positions, where each step is a single push.
+    Player positions are normalised to the top-left-most reachable cell, so
+    every position the player can walk between is stored once in the
+    transposition table. Positions are ranked by their Matching lower bound,
+    which also prunes any where the boxes can't all reach distinct goals.
+
+    max_bytes limits what the search builds up as it goes: the transposition
+    table plus the open list, whose entries keep their Matching packed. Once
+    they pass it the search gives up. Tables made once per board (dead
+    squares, push distances) come on top. With a spill directory the
+    transposition table moves to a file there instead of counting against
+    the limit, see ClosedSet.
+    '''
+
+    def __init__(self, game_map, max_nodes = 5000, weight = 2, max_bytes = None, spill = None):
+        start = game_map if isinstance(game_map, State) else State.from_map(game_map)
+        self.board = start.board
+        self.height = self.board.height
+        self.width = self.board.width
+        self.max_nodes = max_nodes
+        self.weight = weight
+        self.max_bytes = max_bytes #Memory the transposition table and open list may use together
+        self.spill = spill #Directory the table moves to past max_bytes, None to keep it in memory
+        self.walls = self.board.wall_array()
+        self.goals = self.board.goals
+        self.boxes = start.boxes
+        self.player = start.player
+        self.deltas = self.board.deltas()
+        self.directions = {d: number for number, d in enumerate(self.deltas)}
+        self.deadlocks = Deadlocks(self.board)
+        self.dead = self.deadlocks.dead
+        self.push = push_distances(self.board, self.walls)
+
+    def reachable(self, start, boxes):
+        '''
+        Params: start, boxes (int, int)
+        Outputs: seen (bytearray)
+        Flood fills the cells the player can walk to without pushing anything.
+        '''
+        return reachable(self.walls, self.deltas, start, boxes)
+
+    def start(self):
+        '''
+        Params: None
+        Outputs: Matching or None
+        The Matching for the starting position, or None if it's plainly unsolvable.
+        '''
+        cells = bit_cells(self.boxes)
+        if(self.player is None or len(cells) < len(bit_cells(self.goals))):
+            return None
+        for box in cells:
+            if(self.dead[box] or self.deadlocks.deadlocked(self.boxes, box)):
+                return None
+        matching = Matching(self.push, cells)
+        return None if matching.total >= Unreachable else matching
+
+    def successors(self, boxes, seen, matching):
+        '''
+        Params: boxes, seen, matching (int, bytearray, Matching)
+        Outputs: generator of (moved, box, d, Matching)
+        Every push the player can make from the cells in seen that doesn't
+        leave a deadlock, with the boxes and matching after it.
+        '''
+        walls = self.walls
+        dead = self.dead
+        deadlocked = self.deadlocks.deadlocked
+        for box in bit_cells(boxes):
+            for d in self.deltas:
+                dest = box + d
+                if(not seen[box - d] or walls[dest] or dead[dest] or (boxes >> dest) & 1):
+                    continue
+                moved = boxes ^ (1 << box) ^ (1 << dest)
+                if(deadlocked(moved, dest)):
+                    continue
+                after = matching.moved(box, dest)
+                if(after.total < Unreachable):
+                    yield moved, box, d, after
+
+    def solve(self):
+        '''
+        Params: None
+        Outputs: SolverResult
+        Runs the search until the map is solved, proven unsolvable or the
+        node budget is spent.
+        '''
+        matching = self.start()
+        if(matching is None):
+            return SolverResult(UNSOLVABLE, None, 0)
+        goals = self.goals
+        table = matching.table
+        counter = 0
+        packed = matching.pack()
+        frontier = [(0, 0, counter, self.boxes, self.player, packed, Start, 0)]
+        queued = entry_bytes(self.boxes, packed) #Memory held by frontier
+        nodes = 0
+        closed = None
+        try:
+            closed = self.closed_set() #Transposition table, also used to rebuild the solution
+            while(frontier):
+                f, g, _, boxes, player, packed, pushed, direction = heapq.heappop(frontier)
+                queued -= entry_bytes(boxes, packed)
+                seen = self.reachable(player, boxes)
+                player = seen.index(1)
+                if(not closed.add(boxes, player, pushed, direction)):
+                    continue
+                if(not (goals & ~boxes)):
+                    return SolverResult(SOLVED, self.rebuild(closed.push, boxes, player), nodes)
+                nodes += 1
+                if(nodes > self.max_nodes):
+                    return SolverResult(GAVE_UP, None, nodes)
+                for moved, box, d, after in self.successors(boxes, seen, Matching.unpack(table, packed)):
+                    counter += 1
+                    packed = after.pack()
+                    queued += entry_bytes(moved, packed)
+                    heapq.heappush(frontier, (g + 1 + self.weight * after.total, g + 1, counter, moved, box, packed, box, self.directions[d]))
+                self.check_memory(closed, queued)
+        except MemoryError:
+            return SolverResult(GAVE_UP, None, nodes)
+        finally:
+            if(closed is not None):
+                closed.close()
+        return SolverResult(UNSOLVABLE, None, nodes)
+
+    def check_memory(self, closed, queued):
+        '''
+        Params: closed, queued (ClosedSet, int)
+        Outputs: None
+        Raises MemoryError once the transposition table (unless it's on disk)
+        and queued bytes of open list add up to more than max_bytes.
+        '''
+        if(self.max_bytes is not None and closed.memory() + queued > self.max_bytes):
+            raise MemoryError("search needs more than %d bytes" % self.max_bytes)
+
+    def closed_set(self):
+        live = [cell for cell in range(len(self.walls)) if not self.walls[cell] and not self.dead[cell]]
+        return ClosedSet(live, len(self.walls), len(bit_cells(self.boxes)), self.max_bytes, self.spill)
+
+    def unpush(self, boxes, box, direction):
+        '''
+        Params: boxes, box, direction (int, int, int)
+        Outputs: boxes, player (int, int)
+        The position a push came from: the box on cell box was pushed the
+        direction'th way to get boxes. The player is normalised like the
+        transposition table's keys.
+        '''
+        d = self.deltas[direction]
+        boxes ^= (1 << box) | (1 << (box + d))
+        return boxes, self.reachable(box - d, boxes).index(1)
+
+    def rebuild(self, lookup, boxes, player):
+        '''
+        Params: lookup, boxes, player (function, int, int)
+        Outputs: pushes (list)
+        Walks back from a solved position, undoing the push lookup(boxes, player)
+        says reached each position until it gets to the start.
+        '''
+        pushes = []
+        while(True):
+            box, direction = lookup(boxes, player)
+            if(box == Start):
+                break
+            pushes.append((box, self.deltas[direction]))
+            boxes, player = self.unpush(boxes, box, direction)
+        pushes.reverse()
+        return pushes
+
+
+def solve(game_map, max_nodes = 5000):
+    '''
+    Params: game_map, max_nodes (GameMap or State, int)
+    Outputs: SolverResult
+    Convenience wrapper around Solver.
+    '''
+    return Solver(game_map, max_nodes).solve()
@@ -0,0 +1,359 @@
+'''
+Compact game state. A map is split into a static Board (walls and goals)
+and a small State (box positions and the player), so positions can be
+copied, hashed and compared without walking the Tile object graph.
+
+Cells are addressed by flat index: row * width + col.
+'''
+
+import random
+from array import array
+
+
+def bit_cells(bits):
+    '''
+    Params: bits (int)
+    Outputs: cells (list)
+    Returns the index of every set bit, lowest first.
+    '''
+    cells = []
+    while(bits):
+        low = bits & -bits
+        cells.append(low.bit_length() - 1)
+        bits ^= low
+    return cells
+
+
+def reachable(walls, deltas, start, boxes):
+    '''
+    Params: walls, deltas, start, boxes (bytearray, tuple, int, int)
+    Outputs: seen (bytearray)
+    Flood fills the cells the player can walk to from start without pushing anything.
+    '''
+    seen = bytearray(len(walls))
+    seen[start] = 1
+    stack = [start]
+    while(stack):
+        cell = stack.pop()
+        for d in deltas:
+            nxt = cell + d
+            if(not seen[nxt] and not walls[nxt] and not (boxes >> nxt) & 1):
+                seen[nxt] = 1
+                stack.append(nxt)
+    return seen
+
+
+def replay(state, moves):
+    '''
+    Params: state, moves (State, String)
+    Outputs: solved, applied, final (bool, int, State)
+    Plays a LURD move string (u/d/l/r, uppercase for pushes) from state.
+    Stops at the first illegal move; applied is how many moves went through,
+    which is len(moves) for a fully legal recording. The case of each letter
+    isn't checked, the board decides whether a move pushes.
+    '''
+    board = state.board
+    width = board.width
+    grid = board.wall_array() #0 floor, 1 wall, 2 box
+    for cell in bit_cells(state.boxes):
+        grid[cell] = 2
+    offsets = [0] * 256
+    for letters, offset in (("uU", -width), ("dD", width), ("lL", -1), ("rR", 1)):
+        for letter in letters:
+            offsets[ord(letter)] = offset
+    player = state.player
+    applied = 0
+    for code in moves.encode("ascii", "replace"):
+        d = offsets[code]
+        if(not d):
+            break
+        nxt = player + d
+        if(grid[nxt]):
+            if(grid[nxt] == 1 or grid[nxt + d]):
+                break
+            grid[nxt] = 0
+            grid[nxt + d] = 2
+        player = nxt
+        applied += 1
+    boxes = 0
+    for cell in range(len(grid)):
+        if(grid[cell] == 2):
+            boxes |= 1 << cell
+    final = State(board, boxes, player)
+    return final.is_solved(), applied, final
+
+
+def pushes_to_lurd(state, pushes):
+    '''
+    Params: state, pushes (State, list)
+    Outputs: String
+    Turns a solution given as (cell, delta) pushes, as produced by the solver and
+    the pull generator, into a full LURD move string, walking the player
+    between pushes along shortest paths.
+    '''
+    board = state.board
+    walls = board.wall_array()
+    deltas = board.deltas()
+    letters = dict(zip(deltas, "udlr"))
+    boxes = state.boxes
+    player = state.player
+    result = []
+    for cell, d in pushes:
+        target = cell - d
+        parents = {player: None}
+        queue = [player]
+        for current in queue:
+            if(current == target):
+                break
+            for step in deltas:
+                nxt = current + step
+                if(nxt not in parents and not walls[nxt] and not (boxes >> nxt) & 1):
+                    parents[nxt] = current
+                    queue.append(nxt)
+        if(target not in parents):
+            raise ValueError("push from %d can't be reached" % cell)
+        walk = []
+        current = target
+        while(parents[current] is not None):
+            walk.append(letters[current - parents[current]])
+            current = parents[current]
+        result.extend(reversed(walk))
+        result.append(letters[d].upper())
+        boxes ^= (1 << cell) | (1 << (cell + d))
+        player = cell
+    return "".join(result)
+
+
+class Zobrist():
+    '''
+    Random 64 bit keys for each cell, one table each for walls, goals, boxes
+    and the player. A position's hash is the xor of the keys for everything
+    on it, so moving one thing only takes two xors to update it.
+    Every board of the same size shares one set of tables (see for_size), so
+    equal levels hash equal wherever they came from. Levels are hashed in
+    their normalised form (see State.normalised), so a generated level and its
+    copy read back from a pack hash the same.
+    '''
+    tables = {} #(height, width) -> Zobrist
+
+    def __init__(self, height, width):
+        rng = random.Random(height * 100003 + width)
+        cells = height * width
+        self.wall = [rng.getrandbits(64) for cell in range(cells)]
+        self.goal = [rng.getrandbits(64) for cell in range(cells)]
+        self.box = [rng.getrandbits(64) for cell in range(cells)]
+        self.player = [rng.getrandbits(64) for cell in range(cells)]
+
+    @classmethod
+    def for_size(cls, height, width):
+        if((height, width) not in cls.tables):
+            cls.tables[(height, width)] = cls(height, width)
+        return cls.tables[(height, width)]
+
+    def bits(self, table, bits):
+        '''
+        Params: table, bits (list, int)
+        Outputs: int
+        The xor of table's keys for every set bit.
+        '''
+        result = 0
+        for cell in bit_cells(bits):
+            result ^= table[cell]
+        return result
+
+    def position(self, state):
+        '''
+        Params: state (State)
+        Outputs: int
+        Hash of the boxes and the exact player cell. This is the one kept
+        up to date move by move, see MapController.track.
+        '''
+        return self.bits(self.box, state.boxes) ^ self.player[state.player]
+
+    def canonical(self, state):
+        '''
+        Params: state (State)
+        Outputs: int
+        Hash of the whole level: walls, goals, boxes and the player
+        normalised to the first cell it can walk to, so positions the
+        player can walk between hash the same.
+        '''
+        state = state.normalised()
+        board = state.board
+        player = reachable(board.wall_array(), board.deltas(), state.player, state.boxes).index(1)
+        return self.bits(self.wall, board.walls) ^ self.bits(self.goal, board.goals) ^ self.bits(self.box, state.boxes) ^ self.player[player]
+
+
+class Board():
+    '''
+    The parts of a map that never change during play.
+    walls and goals are integer bitmaps over the flat grid.
+    '''
+    __slots__ = ("height", "width", "walls", "goals")
+
+    def __init__(self, height, width, walls, goals):
+        self.height = height
+        self.width = width
+        self.walls = walls
+        self.goals = goals
+
+    def index(self, row, col):
+        return row * self.width + col
+
+    def coords(self, index):
+        '''
+        Params: index (int)
+        Outputs: row, col (int, int)
+        '''
+        return divmod(index, self.width)
+
+    def deltas(self):
+        '''
+        Params: None
+        Outputs: (up, down, left, right) flat offsets
+        '''
+        return (-self.width, self.width, -1, 1)
+
+    def wall_array(self):
+        '''
+        Params: None
+        Outputs: walls (bytearray)
+        One byte per cell, for tight loops where shifting big ints is too slow.
+        '''
+        walls = bytearray(self.height * self.width)
+        for cell in bit_cells(self.walls):
+            walls[cell] = 1
+        return walls
+
+    def regions(self):
+        '''
+        Params: None
+        Outputs: labels (array)
+        Labels each connected area of non-wall cells with its own number
+        (walls get 0) in a single pass. Two cells can be walked between,
+        ignoring boxes, exactly when their labels match.
+        '''
+        walls = self.wall_array()
+        deltas = self.deltas()
+        labels = array("i", bytes(4 * len(walls)))
+        label = 0
+        for start in range(len(walls)):
+            if(walls[start] or labels[start]):
+                continue
+            label += 1
+            labels[start] = label
+            stack = [start]
+            while(stack):
+                cell = stack.pop()
+                for d in deltas:
+                    nxt = cell + d
+                    if(0 <= nxt < len(walls) and not walls[nxt] and not labels[nxt]):
+                        labels[nxt] = label
+                        stack.append(nxt)
+        return labels
+
+    def __eq__(self, other):
+        return isinstance(other, Board) and (self.height, self.width, self.walls, self.goals) == (other.height, other.width, other.walls, other.goals)
+
+    def __hash__(self):
+        return hash((self.height, self.width, self.walls, self.goals))
+
+
+class State():
+    '''
+    A position on a Board: boxes as an integer bitset and the player as a
+    single cell index. The board is shared between copies, never cloned.
+    '''
+    __slots__ = ("board", "boxes", "player")
+
+    def __init__(self, board, boxes, player):
+        self.board = board
+        self.boxes = boxes
+        self.player = player
+
+    @classmethod
+    def from_map(cls, game_map):
+        '''
+        Params: game_map (GameMap)
+        Outputs: State
+        Builds a compact state from a map's tiles.
+        '''
+        width = game_map.width
+        walls = 0
+        goals = 0
+        boxes = 0
+        player = None
+        for row in range(game_map.height):
+            for col in range(width):
+                tile = game_map.tiles[row][col]
+                bit = 1 << (row * width + col)
+                if(not tile.obj_passable):
+                    walls |= bit
+                if(tile.base_sprite == "U"):
+                    goals |= bit
+                for obj in tile.contents:
+                    if(obj.name == "Box"):
+                        boxes |= bit
+                    elif(obj.name == "Player"):
+                        player = row * width + col
+        return cls(Board(game_map.height, width, walls, goals), boxes, player)
+
+    def copy(self):
+        return State(self.board, self.boxes, self.player)
+
+    def normalised(self):
+        '''
+        Params: None
+        Outputs: State
+        The same level with every floor cell the player can never walk to (and
+        that holds no goal or box) turned into wall. Generated maps can have
+        such pockets, but an XSB file can't tell them apart from the outside,
+        so levels are stored and compared in this form.
+        '''
+        board = self.board
+        height = board.height
+        width = board.width
+        inside = 1 << self.player
+        stack = [self.player]
+        #Flood out from the player, ignoring boxes and without wrapping round row ends
+        while(stack):
+            cell = stack.pop()
+            row, col = divmod(cell, width)
+            for nrow, ncol in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                nxt = nrow * width + ncol
+                if(0 <= nrow < height and 0 <= ncol < width and not ((inside | board.walls) >> nxt) & 1):
+                    inside |= 1 << nxt
+                    stack.append(nxt)
+        outside = ((1 << (height * width)) - 1) & ~(inside | board.walls | board.goals | self.boxes)
+        if(not outside):
+            return self
+        return State(Board(height, width, board.walls | outside, board.goals), self.boxes, self.player)
+
+    def box_cells(self):
+        return bit_cells(self.boxes)
+
+    def box_count(self):
+        return bin(self.boxes).count("1")
+
+    def has_box(self, index):
+        return (self.boxes >> index) & 1
+
+    def is_solved(self):
+        '''
+        Params: None
+        Outputs: True or False
+        True once every goal has a box on it.
+        '''
+        return not (self.board.goals & ~self.boxes)
+
+    def __eq__(self, other):
+        return isinstance(other, State) and self.boxes == other.boxes and self.player == other.player and self.board == other.board
+
+    def __hash__(self):
+        return hash((self.boxes, self.player))
+
+    def canonical_hash(self):
+        return Zobrist.for_size(self.board.height, self.board.width).canonical(self)
+
+    def __repr__(self):
+        return "State(boxes=%s, player=%s)" % (self.box_cells(), self.player)
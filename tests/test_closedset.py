@@ -0,0 +1,38 @@
+'''
+The compact transposition table, in memory and spilled to disk.
+'''
+import mmap
+import random
+import pytest
+from closedset import ClosedSet, Start
+
+
+def positions(count, cells = 100, boxcount = 6):
+    rng = random.Random(3)
+    found = {}
+    while(len(found) < count):
+        boxes = sum(1 << cell for cell in rng.sample(range(cells), boxcount))
+        found[(boxes, rng.randrange(cells))] = (rng.randrange(cells), rng.randrange(4))
+    return found
+
+
+def test_spills_to_disk(tmp_path):
+    closed = ClosedSet(list(range(100)), 100, 6, max_bytes = 4096, spill = str(tmp_path))
+    expected = positions(3000)
+    for (boxes, player), (box, d) in expected.items():
+        assert closed.add(boxes, player, box, d)
+        assert not closed.add(boxes, player, box, d)
+    assert isinstance(closed.table, mmap.mmap)
+    assert closed.memory() == 0 and closed.nbytes() > 4096
+    assert len(closed) == len(expected)
+    for position, push in expected.items():
+        assert closed.push(*position) == push
+    assert closed.push(1, 2) is None
+    closed.close()
+
+
+def test_limit_without_spill():
+    closed = ClosedSet(list(range(100)), 100, 6, max_bytes = 4096)
+    with pytest.raises(MemoryError):
+        for boxes, player in positions(3000):
+            closed.add(boxes, player, Start)
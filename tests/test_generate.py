@@ -0,0 +1,23 @@
+'''
+RandomGameMap generation: walk mode falls back to pull mode once its
+solver checks have used up their budget.
+'''
+import core
+from solver import Solver, SOLVED
+
+
+class Impatient(core.RandomGameMap):
+    check_budget = 1
+
+
+def test_walk_falls_back_to_pull():
+    mp = Impatient(*core.level_params(3), "walk", 2)
+    assert mp.mode == "pull"
+    assert mp.stats.rejections()["solver: gave up"] == 1
+    assert Solver(mp.to_state(), max_nodes = 50000).solve().status == SOLVED
+
+
+def test_walk_keeps_checked_maps():
+    mp = core.RandomGameMap(*core.level_params(0), "walk", 1)
+    assert mp.mode == "walk"
+    assert 0 < mp.solver_nodes <= core.RandomGameMap.check_nodes * mp.boxcount + 1
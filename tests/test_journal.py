@@ -0,0 +1,79 @@
+'''
+Playing maps through MapController: the move journal, undo and redo, the
+position hash, and recording finished levels.
+'''
+import random
+import core
+from state import replay, pushes_to_lurd
+
+
+def pull_maps(count):
+    return [core.RandomGameMap(*core.level_params(level), "pull", 200 + level) for level in range(count)]
+
+
+def play(mc, moves):
+    for letter in moves:
+        dx, dy = core.Directions["udlr".index(letter.lower())]
+        mc.try_step(dx, dy, mc.get_player_tile())
+
+
+def start(maps):
+    mc = core.MapController()
+    mc.all_maps = list(maps)
+    mc.solved = []
+    mc.load_next_map()
+    return mc
+
+
+def random_moves(mc, count, seed):
+    rng = random.Random(seed)
+    play(mc, "".join(rng.choice("udlr") for move in range(count)))
+
+
+def test_journal_undo_redo():
+    mp = core.RandomGameMap(*core.level_params(3), "pull", 7)
+    start_state = mp.to_state()
+    mc = start([mp])
+    random_moves(mc, 300, 1)
+    moves = mc.lurd()
+    played = mp.to_state()
+    assert mc.moves == len(mc.history) == len(moves)
+    assert any(letter.isupper() for letter in moves)
+    assert replay(start_state, moves)[2] == played
+    for undone in range(len(moves)):
+        assert mc.undo()
+    assert not mc.undo()
+    assert mc.moves == 0 and mp.to_state() == start_state
+    while(mc.redo()):
+        pass
+    assert mc.lurd() == moves and mp.to_state() == played
+    mc.restart()
+    assert mc.moves == 0 and mp.to_state() == start_state
+    assert mc.redo()
+    random_moves(mc, 20, 2)
+    assert not mc.redo()
+    assert mc.lurd()[0] == moves[0]
+
+
+def test_position_hash_follows_moves():
+    mp = core.RandomGameMap(*core.level_params(3), "pull", 8)
+    mc = start([mp])
+    start_hash = mc.position_hash
+    for seed in range(5):
+        random_moves(mc, 60, seed)
+        assert mc.position_hash == mc.zobrist.position(mp.to_state())
+        for undone in range(25):
+            mc.undo()
+        assert mc.position_hash == mc.zobrist.position(mp.to_state())
+    mc.restart()
+    assert mc.position_hash == start_hash
+
+
+def test_finished_levels_are_recorded():
+    maps = pull_maps(3)
+    recordings = [(mp.id, pushes_to_lurd(mp.to_state(), mp.solution)) for mp in maps[:2]]
+    mc = start(maps)
+    for ids, moves in recordings:
+        play(mc, moves)
+    assert mc.current_map is maps[2]
+    assert mc.solved == recordings
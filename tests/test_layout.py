@@ -0,0 +1,37 @@
+'''
+Wall layouts drawn with NumPy against the same layouts drawn in Python.
+'''
+import random
+import pytest
+import core
+import layout
+
+
+def test_line_cells_skip_start():
+    assert layout.line_cells(1, 1, 3, 2) == [(2, 1), (2, 2), (3, 2)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batch_matches_python(seed):
+    np = layout.load_numpy()
+    if(np is None):
+        pytest.skip("needs numpy")
+    rng = random.Random(seed)
+    height, width, wallcount = rng.randint(5, 20), rng.randint(5, 20), rng.randint(0, 12)
+    batch = [layout.wall_lines(rng, height, width, wallcount) for count in range(8)]
+    drawn = layout.draw_batch(np, batch, height, width)
+    assert drawn == [layout.draw_python(lines, height, width) for lines in batch]
+
+
+class OneLayout(core.RandomGameMap):
+    layout_batch = 1
+
+
+def test_batch_size_keeps_maps():
+    for mode in ("pull", "walk"):
+        for level in (0, 2):
+            args = core.level_params(level) + (mode, 300 + level)
+            batched = core.RandomGameMap(*args)
+            single = OneLayout(*args)
+            assert batched.to_state() == single.to_state()
+            assert len(batched.stats.attempts) == len(single.stats.attempts)
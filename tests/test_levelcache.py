@@ -0,0 +1,37 @@
+'''
+The on-disk level cache: hits, misses and least recently used eviction.
+'''
+import os
+import core
+from levelcache import LevelCache
+
+
+def level():
+    return core.RandomGameMap(*core.level_params(1), "pull", 400).to_state()
+
+
+def test_get_and_put(tmp_path):
+    cache = LevelCache(str(tmp_path))
+    state = level()
+    assert cache.get(("a",)) is None
+    cache.put(("a",), state)
+    assert cache.get(("a",)) == state
+    assert cache.get(("b",)) is None
+
+
+def test_least_recently_used_go_first(tmp_path):
+    state = level()
+    cache = LevelCache(str(tmp_path))
+    cache.put(("first",), state)
+    size = os.path.getsize(cache.path(("first",)))
+    cache.max_bytes = 2 * size + size // 2
+    cache.put(("second",), state)
+    #Make the order certain whatever the file system's timestamp resolution
+    os.utime(cache.path(("first",)), (1000, 1000))
+    os.utime(cache.path(("second",)), (2000, 2000))
+    assert cache.get(("first",)) == state
+    assert os.path.getmtime(cache.path(("first",))) > 2000
+    cache.put(("third",), state)
+    assert cache.get(("second",)) is None
+    assert cache.get(("first",)) == state
+    assert cache.get(("third",)) == state
@@ -0,0 +1,86 @@
+'''
+Writing levels to a pack and reading them back, including packs made by
+other programs.
+'''
+import core
+from levelpack import LevelPack, write_pack, to_xsb, from_xsb
+from state import Board, State
+
+
+def generated_levels(count):
+    return [core.RandomGameMap(*core.level_params(level), "pull", 100 + level).to_state() for level in range(count)]
+
+
+def test_generated_levels_round_trip(tmp_path):
+    path = str(tmp_path / "levels.xsb")
+    states = generated_levels(6)
+    assert write_pack(path, states) == len(states)
+    with LevelPack(path) as pack:
+        assert len(pack) == len(states)
+        for state, loaded in zip(states, pack):
+            assert loaded == state
+            assert loaded.canonical_hash() == state.canonical_hash()
+        assert from_xsb(pack.text(-1)).boxes == states[-1].boxes
+
+
+def test_unreachable_floor_is_wall():
+    sealed = from_xsb("#######\n#@$.# #\n#######")
+    pocket = sealed.board.index(1, 5)
+    assert (sealed.board.walls >> pocket) & 1
+    board = sealed.board
+    opened = State(Board(board.height, board.width, board.walls & ~(1 << pocket), board.goals), sealed.boxes, sealed.player)
+    assert opened != sealed
+    assert opened.normalised() == sealed
+    assert opened.canonical_hash() == sealed.canonical_hash()
+
+
+def test_pack_with_metadata(tmp_path):
+    path = tmp_path / "other.xsb"
+    path.write_text("Collection: Somewhere else\n"
+                    "Author: Someone\n"
+                    "\n"
+                    "Level 1\n"
+                    "#####\n"
+                    "#@$.#\n"
+                    "#####\n"
+                    "Title: First\n"
+                    "\n"
+                    "; 2\n"
+                    "  ####\n"
+                    "###  #\n"
+                    "#@ $.#\n"
+                    "######\n"
+                    "Title: Second\n"
+                    "Author: Someone\n"
+                    "\n", encoding = "utf-8")
+    with LevelPack(str(path)) as pack:
+        assert len(pack) == 2
+        first, second = pack
+    assert (first.board.height, first.board.width) == (3, 5)
+    assert to_xsb(first) == "#####\n#@$.#\n#####"
+    assert (second.board.height, second.board.width) == (4, 6)
+    assert second.box_count() == 1
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / "grown.xsb")
+    states = generated_levels(2)
+    write_pack(path, states[:1])
+    with LevelPack(path) as pack:
+        assert len(pack) == 1
+    with open(path, "a") as pack:
+        pack.write("; 2\n%s\n\n" % to_xsb(states[1]))
+    with LevelPack(path) as pack:
+        assert len(pack) == 2
+        assert list(pack) == states
+
+
+def test_empty_pack(tmp_path):
+    path = tmp_path / "empty.xsb"
+    path.write_bytes(b"")
+    with LevelPack(str(path)) as pack:
+        assert len(pack) == 0
+        assert list(pack) == []
+    assert write_pack(str(path), []) == 0
+    with LevelPack(str(path)) as pack:
+        assert len(pack) == 0
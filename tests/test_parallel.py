@@ -0,0 +1,53 @@
+'''
+The parallel solver against the sequential one: same answers, and the work
+spread evenly over the workers.
+'''
+import collections
+import random
+import core
+from parallel import ParallelSolver, owner
+from solver import Solver, SOLVED
+from state import replay, pushes_to_lurd
+from test_solver import random_level
+
+
+def test_owner_spreads_positions():
+    rng = random.Random(2)
+    for height, width, boxcount in ((11, 11, 8), (16, 16, 20)):
+        cells = [cell for cell in range(height * width) if cell % width not in (0, width - 1)]
+        positions = [sum(1 << cell for cell in rng.sample(cells[width:-width], boxcount)) for position in range(4000)]
+        for jobs in (4, 8, 16):
+            counts = collections.Counter(owner(boxes, jobs) for boxes in positions)
+            assert len(counts) == jobs
+            assert max(counts.values()) < 1.3 * len(positions) / jobs
+
+
+def test_same_status_as_solver():
+    rng = random.Random(5)
+    for level in range(12):
+        state = random_level(rng, 7, 7, 2, 6)
+        expected = Solver(state, max_nodes = 100000).solve().status
+        for jobs in (1, 3):
+            result = ParallelSolver(state, jobs, max_nodes = 100000).solve()
+            assert result.status == expected
+            if(result.status == SOLVED):
+                assert replay(state, pushes_to_lurd(state, result.pushes))[0]
+
+
+def test_workers_share_rounds():
+    nodes = 0
+    critical = 0
+    for level in range(6):
+        state = core.RandomGameMap(*core.level_params(level), "pull", 1000 * level).to_state()
+        expected = Solver(state, max_nodes = 50000).solve()
+        one = ParallelSolver(state, 1, max_nodes = 50000)
+        result = one.solve()
+        assert (result.status, result.nodes) == (expected.status, expected.nodes)
+        assert one.critical == result.nodes
+        four = ParallelSolver(state, 4, max_nodes = 50000)
+        result = four.solve()
+        assert result.status == expected.status == SOLVED
+        nodes += result.nodes
+        critical += four.critical
+    #Every worker has a full batch most rounds, so the busiest does little more than its share
+    assert nodes > 3 * critical
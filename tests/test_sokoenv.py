@@ -0,0 +1,52 @@
+'''
+Stepping batched games and the rewards they hand out.
+'''
+import pytest
+from levelpack import from_xsb
+
+np = pytest.importorskip("numpy")
+from sokoenv import SokobanEnv, StepReward, BoxOnGoalReward, BoxOffGoalReward, SolvedReward
+
+Up, Down, Left, Right = range(4)
+
+Corridor = from_xsb("######\n#@$ .#\n######") #Two pushes right solve it
+Moved = from_xsb("######\n#@* .#\n#  $ #\n######") #A box that starts on a goal
+
+
+def test_push_to_solve():
+    env = SokobanEnv([Corridor], count = 2)
+    obs = env.reset()
+    assert obs.shape == (2, 4, 3, 6)
+    assert obs[0, 3, 1, 1] == 1 and obs[0, 2, 1, 2] == 1
+    obs, rewards, dones, solved = env.step(np.array([Left, Right]))
+    assert np.allclose(rewards, StepReward)
+    assert obs[0, 3, 1, 1] == 1 #Walked into the wall, nothing moved
+    assert obs[1, 3, 1, 2] == 1 and obs[1, 2, 1, 3] == 1
+    assert not dones.any()
+    obs, rewards, dones, solved = env.step(np.array([Up, Right]))
+    assert np.allclose(rewards, [StepReward, StepReward + BoxOnGoalReward + SolvedReward])
+    assert list(dones) == [False, True] and list(solved) == [False, True]
+    assert obs[1, 3, 1, 1] == 1 and obs[1, 2, 1, 2] == 1 #Reset onto the level again
+    assert list(env.steps) == [2, 0]
+
+
+def test_box_off_goal_and_step_limit():
+    env = SokobanEnv([Moved, Corridor], max_steps = 2)
+    env.reset()
+    assert list(env.level_numbers) == [0]
+    obs, rewards, dones, solved = env.step(np.array([Right]), observe = False)
+    assert obs is None
+    assert np.allclose(rewards, StepReward + BoxOffGoalReward)
+    assert env.on_goal[0] == 0 and not dones[0]
+    obs, rewards, dones, solved = env.step(np.array([Right]))
+    assert dones[0] and not solved[0]
+    assert list(env.level_numbers) == [1] and obs.shape == (1, 4, 4, 6)
+
+
+def test_blocked_pushes():
+    env = SokobanEnv([from_xsb("#######\n#@$$ .#\n#    .#\n#######")])
+    env.reset()
+    boxes = env.boxes.copy()
+    obs, rewards, dones, solved = env.step(np.array([Right]))
+    assert (env.boxes == boxes).all() and env.player[0] == 8
+    assert np.allclose(rewards, StepReward)
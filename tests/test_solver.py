@@ -0,0 +1,101 @@
+'''
+Checks the solver against exhaustive search, and its Matching lower bound
+against trying every assignment.
+'''
+import itertools
+import random
+import pytest
+from solver import Solver, Matching, Unreachable, SOLVED, GAVE_UP
+from state import Board, State, bit_cells, reachable, replay, pushes_to_lurd
+
+
+def random_level(rng, height, width, boxcount, wallcount):
+    '''
+    A bordered room with a few random inner walls and random goals, boxes and
+    player. Plenty of these can't be solved, which is the point.
+    '''
+    inner = [row * width + col for row in range(1, height - 1) for col in range(1, width - 1)]
+    walls = 0
+    for cell in range(height * width):
+        if(cell not in inner):
+            walls |= 1 << cell
+    chosen = rng.sample(inner, wallcount + boxcount + 1)
+    for cell in chosen[:wallcount]:
+        walls |= 1 << cell
+    floor = [cell for cell in inner if not (walls >> cell) & 1]
+    goals = sum(1 << cell for cell in rng.sample(floor, boxcount))
+    boxes = sum(1 << cell for cell in chosen[wallcount:wallcount + boxcount])
+    player = chosen[-1]
+    return State(Board(height, width, walls, goals), boxes, player)
+
+
+def solvable(state):
+    '''
+    Breadth-first search over every position reachable by pushes, the slow
+    and obviously right answer.
+    '''
+    board = state.board
+    walls = board.wall_array()
+    deltas = board.deltas()
+
+    def key(boxes, player):
+        return boxes, reachable(walls, deltas, player, boxes).index(1)
+
+    start = key(state.boxes, state.player)
+    seen = {start}
+    queue = [start]
+    for boxes, player in queue:
+        if(not (board.goals & ~boxes)):
+            return True
+        region = reachable(walls, deltas, player, boxes)
+        for box in bit_cells(boxes):
+            for d in deltas:
+                dest = box + d
+                if(region[box - d] and not walls[dest] and not (boxes >> dest) & 1):
+                    position = key(boxes ^ (1 << box) ^ (1 << dest), box)
+                    if(position not in seen):
+                        seen.add(position)
+                        queue.append(position)
+    return False
+
+
+@pytest.mark.parametrize("size, boxcount, wallcount", [(6, 2, 3), (7, 2, 6), (7, 3, 5)])
+def test_solver_agrees_with_exhaustive_search(size, boxcount, wallcount):
+    rng = random.Random(size * 10 + boxcount)
+    outcomes = set()
+    for level in range(60):
+        state = random_level(rng, size, size, boxcount, wallcount)
+        result = Solver(state, max_nodes = 100000).solve()
+        assert result.status != GAVE_UP
+        expected = solvable(state)
+        assert (result.status == SOLVED) == expected, state
+        if(expected):
+            solved, applied, final = replay(state, pushes_to_lurd(state, result.pushes))
+            assert solved
+        outcomes.add(expected)
+    assert outcomes == {True, False}
+
+
+def best_assignment(table, cells):
+    best = None
+    for boxes in itertools.permutations(range(len(cells)), len(table)):
+        cost = sum(table[goal][cells[box]] for goal, box in enumerate(boxes))
+        if(best is None or cost < best):
+            best = cost
+    return best if table else 0
+
+
+def test_matching_is_the_cheapest_assignment():
+    rng = random.Random(1)
+    for trial in range(1000):
+        goals = rng.randint(0, 5)
+        table = [[rng.choice([Unreachable] + list(range(9))) for cell in range(12)] for goal in range(goals)]
+        matching = Matching(table, rng.sample(range(12), rng.randint(goals, 6)))
+        assert matching.total == best_assignment(table, matching.cells)
+        for move in range(5):
+            if(not matching.cells):
+                break
+            old = rng.choice(matching.cells)
+            free = [cell for cell in range(12) if cell not in matching.cells]
+            matching = matching.moved(old, rng.choice(free or [old]))
+            assert matching.total == best_assignment(table, matching.cells)